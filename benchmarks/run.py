@@ -0,0 +1,246 @@
+'''
+Benchmarks for LainYaml.load
+
+measures parse latency, peak traced memory and allocated blocks for the
+fixtures in fixtures/data, tests/lain.yaml and synthetic manifests with
+1/10/100/1000 procs, and the speedup of every optimized path over the code
+it replaced (speedup/* cases). Results are written as JSON, and compared
+with a baseline when one is given:
+
+    python benchmarks/run.py --output result.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json --threshold 0.3
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+
+exits with status 1 when any metric is worse than baseline * (1 + threshold),
+or any speedup is below baseline * (1 - threshold)
+'''
+import argparse
+import gc
+import glob
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import humanfriendly
+import yaml
+from jinja2 import Template
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lain_sdk import mydocker  # noqa: E402
+from lain_sdk.lain_yaml import TEMPLATE_DIR, LainYaml  # noqa: E402
+from lain_sdk.yaml import parser as yaml_parser  # noqa: E402
+from lain_sdk.yaml.io import LIBYAML, dump_yaml, load_yaml  # noqa: E402
+from lain_sdk.yaml.parser import LAIN_YAML_SCHEMA, LainYamlSchema  # noqa: E402
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+DOMAINS = ['lain.local']
+REGISTRY = 'registry.lain.local'
+CONTEXT = {'meta_version': META_VERSION, 'domains': DOMAINS, 'registry': REGISTRY}
+PROC_COUNTS = (1, 10, 100, 1000)
+METRICS = ('latency_ms', 'peak_kib', 'blocks')
+# higher is better for these
+SPEEDUP_METRICS = ('speedup', )
+# case -> function returning (old, new), the code an optimized path
+# replaced and that path, or None when the case can not run here
+SPEEDUPS = {}
+
+
+def synthetic_manifest(procs):
+    doc = {'appname': 'bench', 'build': {'base': 'golang', 'script': ['make']},
+           'release': {'dest_base': 'ubuntu', 'copy': ['bench']}}
+    for i in range(procs):
+        kind = ('web', 'worker', 'cron')[i % 3]
+        clause = {'cmd': f'run {i}', 'memory': '128m', 'env': ['A=1'], 'setup_time': '10s'}
+        if kind == 'web':
+            clause.update(port='8080:tcp', mountpoint=[f'/p{i}'])
+        elif kind == 'cron':
+            clause['schedule'] = '* * * * *'
+        doc[f'{kind}.p{i}'] = clause
+    return dump_yaml(doc)
+
+
+def cases():
+    for path in sorted(glob.glob(os.path.join(ROOT, 'fixtures/data/*.yaml'))):
+        yield f'fixtures/{os.path.basename(path)}', open(path).read()
+    yield 'tests/lain.yaml', open(os.path.join(ROOT, 'tests/lain.yaml')).read()
+    for procs in PROC_COUNTS:
+        yield f'synthetic/{procs}-procs', synthetic_manifest(procs)
+
+
+def load(raw):
+    return LainYaml(data=raw, meta_version=META_VERSION, domains=DOMAINS, registry=REGISTRY)
+
+
+def best_time(func, min_time=0.5):
+    '''fastest of at least 5 calls of func, timed for min_time seconds'''
+    func()
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < 5 or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def speedup(case):
+    def register(func):
+        SPEEDUPS[f'speedup/{case}'] = func
+        return func
+    return register
+
+
+@speedup('shared_schema')
+def shared_schema():
+    raw = open(os.path.join(ROOT, 'tests/lain.yaml')).read()
+    return (lambda: LainYamlSchema(context=CONTEXT).load(raw),
+            lambda: LAIN_YAML_SCHEMA.load_with_context(raw, CONTEXT))
+
+
+@speedup('compiled_loader')
+def compiled_loader():
+    schema = LainYamlSchema(context=CONTEXT)
+    compiled = schema.compiled_loader
+    document = load_yaml(synthetic_manifest(90))
+    return lambda: schema.load(document), lambda: compiled(document)
+
+
+@speedup('libyaml')
+def libyaml():
+    if not LIBYAML:
+        return None
+    fixtures = [open(f).read() for f in sorted(glob.glob(os.path.join(ROOT, 'fixtures/data/*.yaml')))]
+    return (lambda: [yaml.load(f, Loader=yaml.SafeLoader) for f in fixtures],
+            lambda: [load_yaml(f) for f in fixtures])
+
+
+@speedup('models_access')
+def models_access():
+    raw = open(os.path.join(ROOT, 'tests/lain.yaml')).read()
+    loaded = LAIN_YAML_SCHEMA.load_with_context(raw, CONTEXT)
+
+    def read(y):
+        return lambda: [y.procs[name].env for name in y.procs] + [y.build.prepare.version, y.release.dest_base]
+
+    return read(LainYaml.from_loaded(loaded)), read(LainYaml.from_loaded(loaded, models=True))
+
+
+@speedup('unit_parsing')
+def unit_parsing():
+    # the units of 10k procs, manifests repeat a handful of distinct strings
+    rng = random.Random(0)
+    units = [(rng.choice(['32m', '64m', '128m', '1g']), rng.choice(['10s', '30s', '1m']),
+              rng.choice(['80:tcp', '8080:tcp', '53:udp'])) for _ in range(10000)]
+
+    def parse_units(parse_memory, parse_timespan, parse_port):
+        return lambda: [(parse_memory(m), parse_timespan(t), parse_port(p)) for m, t, p in units]
+
+    return (parse_units(humanfriendly.parse_size, humanfriendly.parse_timespan,
+                        yaml_parser._parse_port_str.__wrapped__),
+            parse_units(yaml_parser.parse_memory, yaml_parser.parse_timespan, yaml_parser.parse_port))
+
+
+@speedup('validate')
+def validate():
+    document = {'appname': 'big'}
+    for i in range(100):
+        document[f'web.p{i}'] = {'cmd': 'serve', 'mountpoint': [f'/p{i}', f'p{i}.com/x'], 'port': 80}
+    return lambda: LainYaml(data=document, **CONTEXT), lambda: LainYaml.validate(document)
+
+
+@speedup('dockerfile_template')
+def dockerfile_template():
+    source = open(os.path.join(TEMPLATE_DIR, 'build_dockerfile.j2')).read()
+    params = {'base': 'golang', 'workdir': '/lain/app/', 'copy_list': ['.'], 'scripts': ['make'],
+              'build_args': ['A']}
+    return lambda: Template(source).render(params), lambda: mydocker.render_dockerfile(source, params)
+
+
+def measure(raw, min_time=0.5):
+    latency = best_time(lambda: load(raw), min_time)
+
+    # warm every lazily filled cache before counting allocations
+    load(raw)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = load(raw)
+        peak = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    del result
+    return {
+        'latency_ms': round(latency * 1e3, 4),
+        'peak_kib': round(peak / 1024, 1),
+        'blocks': blocks,
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for case, metrics in results.items():
+        for metric, new in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            if not old:
+                continue
+            if metric in SPEEDUP_METRICS and new < old * (1 - threshold):
+                regressions.append(f'{case} {metric}: {old} -> {new} ({(new / old - 1) * 100:.0f}%)')
+            elif metric in METRICS and new > old * (1 + threshold):
+                regressions.append(f'{case} {metric}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark LainYaml.load')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare results with this JSON file')
+    parser.add_argument('--save-baseline', help='write results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='allowed relative regression, default 0.3')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='seconds spent timing every case, default 0.5')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for case, raw in cases():
+        results[case] = measure(raw, min_time=args.min_time)
+        metrics = results[case]
+        print(f'{case:32} {metrics["latency_ms"]:10.3f}ms {metrics["peak_kib"]:10.1f}KiB {metrics["blocks"]:8} blocks')
+    for case, paths in SPEEDUPS.items():
+        paths = paths()
+        if paths is None:
+            continue
+        old, new = paths
+        results[case] = {'speedup': round(best_time(old, args.min_time) / best_time(new, args.min_time), 2)}
+        print(f'{case:32} {results[case]["speedup"]:10.2f}x')
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'regressions beyond {args.threshold * 100:.0f}%:')
+            for regression in regressions:
+                print(f'    {regression}')
+            return 1
+        print(f'no regression beyond {args.threshold * 100:.0f}%')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+'''
+Images reused by a fingerprint of their inputs
+
+a phase fingerprint is the sha256 of everything its image is made of: the
+rendered Dockerfile with base images given by image id, the build args and,
+for phases copying the repo in, a hash of the files docker would be sent.
+A built image is tagged {appname}:cache-{fingerprint} (and pushed with the
+registry prefix when a registry is given), the next build with the same
+fingerprint tags that image instead of running docker build.
+
+>>> fingerprint({'b': 1, 'a': [1, 2]}) == fingerprint({'a': [1, 2], 'b': 1})
+True
+'''
+import hashlib
+import json
+import os
+
+from . import mydocker
+from .buildcontext import DockerIgnore, context_files, context_ignore
+from .util import info, warn
+
+CACHE_TAG_PREFIX = 'cache-'
+
+
+def fingerprint(inputs):
+    '''sha256 of a json serializable dict of inputs'''
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def context_digest(context, ignore=(), bufsize=64 * 1024):
+    '''sha256 of the paths, modes and contents of the files of context that
+    are not excluded by its .dockerignore (or .gitignore) and ignore'''
+    digest = hashlib.sha256()
+    for path in context_files(context, DockerIgnore(context_ignore(context, ignore))):
+        full_path = os.path.join(context, path)
+        st = os.lstat(full_path)
+        digest.update(f'{path}\0{st.st_mode:o}\0'.encode())
+        if os.path.islink(full_path):
+            digest.update(os.readlink(full_path).encode())
+        elif os.path.isfile(full_path):
+            with open(full_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(bufsize), b''):
+                    digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+
+    def __init__(self, appname, registry=None, push=True):
+        self.appname = appname
+        self.registry = registry
+        self.push = push
+
+    def cache_tag(self, fp):
+        return CACHE_TAG_PREFIX + fp
+
+    def local_name(self, fp):
+        return f'{self.appname}:{self.cache_tag(fp)}'
+
+    def remote_name(self, fp):
+        return f'{self.registry}/{self.local_name(fp)}'
+
+    def lookup(self, fp):
+        '''name of a local image built from fp, pulled from the registry if
+        it is only there, None on a miss'''
+        local = self.local_name(fp)
+        if mydocker.exist(local):
+            return local
+        if self.registry and self.cache_tag(fp) in mydocker.get_tag_list_in_registry(self.registry, self.appname):
+            remote = self.remote_name(fp)
+            if mydocker.pull(remote) == 0:
+                return remote
+            warn(f'FAILED: docker pull {remote}')
+        return None
+
+    def restore(self, fp, name):
+        '''tag the image cached for fp as name, False on a miss'''
+        cached = self.lookup(fp)
+        if cached is None or mydocker.tag(cached, name) != 0:
+            return False
+        info(f'{name} is unchanged, reused {cached}')
+        return True
+
+    def store(self, fp, name):
+        mydocker.tag(name, self.local_name(fp))
+        if self.registry and self.push:
+            remote = self.remote_name(fp)
+            if mydocker.tag(name, remote) != 0 or mydocker.push(remote) != 0:
+                warn(f'FAILED: docker push {remote}')
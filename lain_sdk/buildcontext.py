@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+'''
+Docker build contexts made in python
+
+build_context writes the tar that `docker build -` reads from stdin, with
+the files of a directory that are not excluded by its .dockerignore (or
+.gitignore when there is none, like mydocker.gen_dockerignore does) and the
+extra ignore patterns, plus a Dockerfile that only exists in the tar. The
+working tree is never written to.
+
+>>> ignore = DockerIgnore(['*.pyc', 'build', '!build/keep', '**/.cache'])
+>>> [ignore.excluded(p) for p in ('a.pyc', 'src/a.pyc', 'build/x', 'build/keep', 'src/.cache/x')]
+[True, False, True, False, True]
+'''
+import io
+import os
+import re
+import tarfile
+import time
+
+IGNORE_FILES = ('.dockerignore', '.gitignore')
+
+
+def read_ignore_file(path):
+    '''patterns of a .dockerignore, [] if there is no such file'''
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return []
+    return [line.strip() for line in lines if line.strip() and not line.startswith('#')]
+
+
+def context_ignore(context, ignore=()):
+    '''patterns of the .dockerignore (or .gitignore) of context plus ignore'''
+    for filename in IGNORE_FILES:
+        path = os.path.join(context, filename)
+        if os.path.exists(path):
+            return read_ignore_file(path) + list(ignore)
+    return list(ignore)
+
+
+def compile_pattern(pattern):
+    '''regex of a .dockerignore pattern, following docker's patternmatcher'''
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '*':
+            if pattern[i + 1:i + 2] == '*':
+                i += 1
+                if pattern[i + 1:i + 2] == '/':
+                    i += 1
+                    out.append('(.*/)?')
+                else:
+                    out.append('.*')
+            else:
+                out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                out.append(pattern[i:end + 1].replace('[!', '[^', 1))
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(out) + '$')
+
+
+class DockerIgnore(object):
+    '''
+    patterns of a .dockerignore, the last pattern matching a path decides,
+    a pattern matching a directory also matches everything inside of it
+    '''
+
+    def __init__(self, patterns):
+        self.patterns = []
+        for pattern in patterns:
+            negated = pattern.startswith('!')
+            pattern = os.path.normpath(pattern[1:].strip() if negated else pattern).lstrip('/')
+            if pattern and pattern != '.':
+                self.patterns.append((compile_pattern(pattern), negated))
+        self.has_exceptions = any(negated for _, negated in self.patterns)
+
+    def excluded(self, path):
+        '''path is relative to the context, with / as separator'''
+        parts = path.split('/')
+        prefixes = ['/'.join(parts[:i]) for i in range(len(parts), 0, -1)]
+        excluded = False
+        for regex, negated in self.patterns:
+            if any(regex.match(prefix) for prefix in prefixes):
+                excluded = not negated
+        return excluded
+
+
+def context_files(context, ignore):
+    '''relative paths of the files and directories of context to send, sorted'''
+    for root, dirs, files in os.walk(context):
+        dirs.sort()
+        rel_root = os.path.relpath(root, context)
+        rel_root = '' if rel_root == '.' else rel_root.replace(os.sep, '/') + '/'
+        kept = []
+        for name in dirs:
+            path = rel_root + name
+            if not ignore.excluded(path):
+                yield path
+                kept.append(name)
+            elif ignore.has_exceptions:
+                # something inside may be let in again by a ! pattern
+                kept.append(name)
+        dirs[:] = kept
+        for name in sorted(files):
+            path = rel_root + name
+            if not ignore.excluded(path):
+                yield path
+
+
+def _reset_owner(tarinfo):
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    return tarinfo
+
+
+def build_context(context, out, dockerfile, ignore=(), bufsize=64 * 1024):
+    '''
+    write the build context of directory context as a tar stream to out,
+    with dockerfile as Dockerfile, returns the number of paths sent. With
+    context None the tar only holds the Dockerfile.
+    '''
+    count = 0
+    with tarfile.open(fileobj=out, mode='w|', bufsize=bufsize) as tar:
+        data = dockerfile.encode()
+        tarinfo = tarfile.TarInfo('Dockerfile')
+        tarinfo.size, tarinfo.mtime = len(data), int(time.time())
+        tar.addfile(tarinfo, io.BytesIO(data))
+        if context is None:
+            return count
+        matcher = DockerIgnore(context_ignore(context, ignore))
+        for path in context_files(context, matcher):
+            if path == 'Dockerfile':
+                continue
+            tar.add(os.path.join(context, path), arcname=path, recursive=False, filter=_reset_owner)
+            count += 1
+    return count
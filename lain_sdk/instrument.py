@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+'''
+Timing spans for the image build pipeline
+
+LainYaml.build_* and the docker calls in mydocker run inside spans. A span
+has a name, a wall clock start, a duration in seconds, a dict of attributes
+and the id of the span it is nested in. Every finished span is passed to
+the registered callbacks:
+
+    with Timeline() as timeline:
+        lain_yaml.build_release()
+    timeline.write('timeline.json')
+
+two environment variables turn instrumentation on without touching code:
+
+    LAIN_SDK_TIMELINE=timeline.json   write the timeline when the process exits
+    LAIN_SDK_PROFILE=profiles/        dump a cProfile .prof file per phase
+
+only the outermost phase of a thread is profiled, cProfile can not nest, so
+build_release.prof also covers the build_base and build_prepare it runs.
+'''
+import atexit
+import cProfile
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TIMELINE_ENV = 'LAIN_SDK_TIMELINE'
+PROFILE_ENV = 'LAIN_SDK_PROFILE'
+
+_callbacks = []
+_local = threading.local()
+_ids = itertools.count(1)
+_env_timeline = None
+
+
+class Span(object):
+    __slots__ = ('id', 'parent', 'name', 'start', 'duration', 'attributes', 'thread')
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.id = next(_ids)
+        self.parent = parent
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes or {}
+        self.thread = threading.current_thread().name
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f'Span({self.name!r}, duration={self.duration!r}, attributes={self.attributes!r})'
+
+
+def add_callback(callback):
+    '''callback(span) is called with every finished span'''
+    _setup_from_env()
+    _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    _callbacks.remove(callback)
+
+
+def current_span():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(name, profile=False, **attributes):
+    '''
+    time the block as a span, the span is yielded so attributes can be added
+    on the way. An exception escaping the block is recorded in the error
+    attribute. With profile=True the block is also profiled when
+    LAIN_SDK_PROFILE is set.
+    '''
+    _setup_from_env()
+    parent = current_span()
+    s = Span(name, parent=parent and parent.id, attributes=attributes)
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(s)
+    profiler = _start_profile() if profile else None
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.attributes['error'] = repr(e)
+        raise
+    finally:
+        s.duration = time.perf_counter() - start
+        stack.pop()
+        if profiler is not None:
+            _dump_profile(profiler, s)
+        for callback in list(_callbacks):
+            callback(s)
+
+
+@contextmanager
+def attach(parent):
+    '''make parent, usually a span of another thread, the current span of
+    this thread for the duration of the block'''
+    if parent is None:
+        yield parent
+        return
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(parent)
+    try:
+        yield parent
+    finally:
+        stack.pop()
+
+
+def traced(name, profile=False):
+    '''decorator running every call of the function in a span'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, profile=profile):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_profile():
+    if not os.environ.get(PROFILE_ENV) or getattr(_local, 'profiling', False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is active, e.g. in an other thread on python 3.12+
+        return None
+    _local.profiling = True
+    return profiler
+
+
+def _dump_profile(profiler, s):
+    profiler.disable()
+    _local.profiling = False
+    directory = os.environ[PROFILE_ENV]
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{s.name}-{os.getpid()}-{s.id}.prof')
+    profiler.dump_stats(path)
+    s.attributes['profile'] = path
+
+
+class Timeline(object):
+    '''
+    default exporter, collects spans and writes them as JSON:
+
+        {"spans": [{"id": 1, "parent": null, "name": "build_release",
+                    "start": 1540000000.0, "duration": 12.5,
+                    "attributes": {...}, "thread": "MainThread"}, ...]}
+
+    spans are sorted by start time
+    '''
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __call__(self, s):
+        with self._lock:
+            self.spans.append(s)
+
+    def __enter__(self):
+        add_callback(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_callback(self)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: (s.start, s.id))
+        return {'spans': [s.to_dict() for s in spans]}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+            f.write('\n')
+
+
+def _setup_from_env():
+    global _env_timeline
+    path = os.environ.get(TIMELINE_ENV)
+    if not path or _env_timeline is not None:
+        return
+    _env_timeline = Timeline()
+    _callbacks.append(_env_timeline)
+    atexit.register(_env_timeline.write, path)
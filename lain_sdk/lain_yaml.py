@@ -1,23 +1,42 @@
 # -*- coding: utf-8 -*-
 import collections
+import io
+import json
 import os
 import re
 import subprocess
 import tempfile
 import time
+import uuid
 from functools import partial
 from subprocess import call
 
-import yaml
 from box import Box
+from marshmallow import ValidationError
 
 from . import mydocker
-from .util import error, file_parent_dir, get_cfd, info, mkdir_p, rm, warn, meta_version
-from .yaml.conf import DOCKER_APP_ROOT, DOMAIN, PRIVATE_REGISTRY, user_config
-from .yaml.parser import LainYamlSchema
+from .instrument import span, traced
+from .buildcache import BuildCache, context_digest, fingerprint
+from .util import error, file_parent_dir, info, mkdir_p, rm, warn, meta_version
+from .yaml.cache import MANIFEST_CACHE_PATH, ManifestCache
+from .yaml import conf
+from .yaml.conf import DOCKER_APP_ROOT, user_config
+from .yaml.io import dump_yaml
+from .yaml.models import App
+from .yaml.parser import LAIN_YAML_SCHEMA, LainYamlSchema, dump_annotation
 
 DOMAIN_KEY = user_config.domain_key
-TEMPLATE_DIR = os.path.join(get_cfd(__file__), 'yaml/templates')
+TEMPLATE_DIR = mydocker.TEMPLATE_DIR
+PHASES = ('prepare', 'build', 'release', 'test', 'meta')
+RELEASE_MODES = ('legacy', 'multistage', 'stream')
+J2TEMPS = {
+    'prepare': 'build_dockerfile.j2',
+    'build': 'build_dockerfile.j2',
+    'release': 'release_dockerfile.j2',
+    'test': 'build_dockerfile.j2',
+    'meta': 'meta_dockerfile.j2'
+}
+MULTISTAGE_RELEASE_TEMP = 'release_multistage_dockerfile.j2'
 
 
 class TolerantBox(Box):
@@ -27,6 +46,17 @@ class TolerantBox(Box):
         return self['copy']
 
 
+class ProcBox(TolerantBox):
+    '''box of a single proc, annotation is only serialized on first access
+    and is not a key before, like in lain_sdk.yaml.parser.Proc'''
+
+    def __missing__(self, key):
+        if key != 'annotation':
+            raise KeyError(key)
+        annotation = self['annotation'] = dump_annotation(self)
+        return annotation
+
+
 class LainYaml(object):
     """
     Parser of lain.yaml and API to build images from lain.yaml
@@ -37,38 +67,125 @@ class LainYaml(object):
 
     yaml_path = ''
     raw = ''
-
-    def __init__(self, data=None, meta_version=None, domains=[DOMAIN],
-                 registry=PRIVATE_REGISTRY, lain_yaml_path=None, ignore_prepare=False):
+    schema = None
+    # output of LainYamlSchema.load, see lain_sdk.yaml.export
+    loaded = None
+    # represent loaded data with lain_sdk.yaml.models instead of TolerantBox
+    models = False
+    # meta_version of the git repo of yaml_path, once known
+    repo_meta_version = None
+    # send build contexts from python instead of writing into the repo, see mydocker.context_build
+    stream_context = False
+    # lain_sdk.buildcache.BuildCache reusing build and release images, if any
+    build_cache = None
+
+    def __init__(self, data=None, meta_version=None, domains=None,
+                 registry=None, lain_yaml_path=None, ignore_prepare=False,
+                 cache=None, models=False, disk_cache=False, stream_context=False, build_cache=None):
+        '''pass disk_cache=True with lain_yaml_path to keep the parsed result
+        in .lain/cache next to lain.yaml, see lain_sdk.yaml.cache.ManifestCache,
+        it can not be combined with an in memory cache
+
+        with stream_context=True images are built without writing a
+        Dockerfile or .dockerignore into the repo
+
+        build_cache is a lain_sdk.buildcache.BuildCache, or True for one
+        using the private registry, build and release images are then reused
+        when their inputs did not change
+
+        domains and registry default to the ones in lain configs'''
+        if disk_cache and cache is not None:
+            raise ValueError('cache and disk_cache can not be used together')
+        if domains is None:
+            domains = [conf.DOMAIN]
+        if registry is None:
+            registry = conf.PRIVATE_REGISTRY
         # lazy initialization, if only need to parse, on need to init fields
         # related to actions
         self.act = False
-        if lain_yaml_path:
+        self.models = models
+        self.stream_context = stream_context
+        self.build_cache = build_cache
+        if lain_yaml_path and disk_cache:
+            self.yaml_path = os.path.abspath(lain_yaml_path)
+            self.load_cached(meta_version=meta_version, domains=domains, registry=registry)
+            self.init_act(ignore_prepare=ignore_prepare)
+        elif lain_yaml_path:
             if not meta_version:
-                meta_version = self.calculate_meta_version(lain_yaml_path)
+                meta_version = self.repo_meta_version = self.calculate_meta_version(lain_yaml_path)
 
             self.yaml_path = lain_yaml_path = os.path.abspath(lain_yaml_path)
-            self.load(open(lain_yaml_path).read(), meta_version=meta_version, domains=domains, registry=registry)
+            self.load(open(lain_yaml_path).read(), meta_version=meta_version, domains=domains, registry=registry,
+                      cache=cache)
             self.init_act(ignore_prepare=ignore_prepare)
         elif data:
-            self.load(data, meta_version=meta_version, domains=domains, registry=registry)
+            self.load(data, meta_version=meta_version, domains=domains, registry=registry, cache=cache)
+
+    def load(self, data, meta_version=None, domains=None, registry=None, cache=None):
+        '''load lain.yaml into this object, can take either yaml string or dict
 
-    def load(self, data, meta_version=None, domains=None, registry=None):
-        '''load lain.yaml into this object, can take either yaml string or dict'''
-        schema = LainYamlSchema(context={'meta_version': meta_version,
-                                         'domains': domains,
-                                         'registry': registry})
+        pass a lain_sdk.yaml.cache.ParseCache as cache to skip parsing and
+        validation for content that has been loaded before'''
+        context = {'meta_version': meta_version,
+                   'domains': domains,
+                   'registry': registry}
         if isinstance(data, dict):
-            self.raw = yaml.dump(data)
+            self.raw = dump_yaml(data)
         else:
             self.raw = data
 
-        self.schema = schema
-        loaded = schema.load(data)
-        box = TolerantBox(loaded,
-                          conversion_box=False,
-                          default_box=True,
-                          default_box_attr=None)
+        self.schema = LAIN_YAML_SCHEMA
+        if cache is None:
+            loaded = LAIN_YAML_SCHEMA.load_with_context(data, context)
+        else:
+            loaded = cache.get_or_load(self.raw, context,
+                                       partial(LAIN_YAML_SCHEMA.load_with_context, data, context))
+        self._set_loaded(loaded)
+
+    def load_cached(self, meta_version=None, domains=None, registry=None):
+        '''load self.yaml_path through its on-disk manifest cache'''
+        manifest_cache = ManifestCache(self.yaml_path)
+        context = {'meta_version': meta_version,
+                   'domains': domains,
+                   'registry': registry}
+
+        def loader(raw, context):
+            return LAIN_YAML_SCHEMA.load_with_context(raw, context)
+
+        self.raw, loaded = manifest_cache.get_or_load(context, loader)
+        if not meta_version:
+            self.repo_meta_version = loaded['meta_version']
+        self.schema = LAIN_YAML_SCHEMA
+        self._set_loaded(loaded)
+
+    @staticmethod
+    def validate(data):
+        '''errors of a lain.yaml string or dict, an empty dict if it is valid
+
+        several times faster than load, see LainYamlSchema.validate'''
+        return LAIN_YAML_SCHEMA.validate(data)
+
+    @classmethod
+    def from_loaded(cls, loaded, raw='', models=False):
+        '''build a LainYaml from the output of LainYamlSchema.load'''
+        lain_yaml = cls(models=models)
+        lain_yaml.raw = raw
+        lain_yaml._set_loaded(loaded)
+        return lain_yaml
+
+    def _set_loaded(self, loaded):
+        self.loaded = loaded
+        if self.models:
+            self.app = App.from_loaded(loaded)
+            for k in self.app.fields():
+                setattr(self, k, getattr(self.app, k))
+            return
+
+        box_options = {'conversion_box': False, 'default_box': True, 'default_box_attr': None}
+        box = TolerantBox(loaded, **box_options)
+        procs = box['procs']
+        for name, proc in loaded['procs'].items():
+            procs[name] = ProcBox(proc, **box_options)
         self.box = box
         for k in loaded.keys():
             setattr(self, k, getattr(box, k))
@@ -88,13 +205,16 @@ class LainYaml(object):
         self.ctx = file_parent_dir(self.yaml_path)
         self.workdir = DOCKER_APP_ROOT + '/'  # '/' is need for COPY in Dockefile
 
-        self.ignore = ['.git', '.vagrant']
+        self.ignore = ['.git', '.vagrant', os.path.dirname(MANIFEST_CACHE_PATH)]
 
-        self.gen_name = partial(mydocker.gen_image_name, appname=self.appname, meta_version=self.calculate_meta_version(self.ctx))
+        if self.repo_meta_version is None:
+            self.repo_meta_version = self.calculate_meta_version(self.ctx)
+        if self.build_cache is True:
+            self.build_cache = BuildCache(self.appname, registry=conf.PRIVATE_REGISTRY)
+        self.gen_name = partial(mydocker.gen_image_name, appname=self.appname, meta_version=self.repo_meta_version)
 
-        phases = ('prepare', 'build', 'release', 'test', 'meta')
         self.img_names = {phase: self.gen_name(
-            phase=phase) for phase in phases}
+            phase=phase) for phase in PHASES}
         if ignore_prepare:
             shared_prepare_image_name = None
         else:
@@ -104,34 +224,150 @@ class LainYaml(object):
         else:
             self.img_names['prepare'] = shared_prepare_image_name
 
-        j2temps = {
-            'prepare': 'build_dockerfile.j2',
-            'build': 'build_dockerfile.j2',
-            'release': 'release_dockerfile.j2',
-            'test': 'build_dockerfile.j2',
-            'meta': 'meta_dockerfile.j2'
-        }
         self.img_temps = {phase: self.load_template(
-            j2temps[phase]) for phase in phases}
+            J2TEMPS[phase]) for phase in PHASES}
 
         self.img_builders = {
-            phase: partial(mydocker.build, name=self.img_names[phase], ignore=self.ignore, template=self.img_temps[phase])
-            for phase in phases
+            phase: partial(mydocker.build, name=self.img_names[phase], ignore=self.ignore,
+                           template=self.img_temps[phase], stream=self.stream_context)
+            for phase in PHASES
         }
 
         self.prepare_updater = partial(
-            mydocker.build, ignore=self.ignore, template=self.load_template('build_dockerfile.j2'))
+            mydocker.build, ignore=self.ignore, template=self.load_template('build_dockerfile.j2'),
+            stream=self.stream_context)
 
         self.act = True
 
     @staticmethod
     def load_template(filename):
-        with open(os.path.join(TEMPLATE_DIR, filename)) as f:
-            return f.read()
+        '''compiled template from TEMPLATE_DIR, shared by every LainYaml'''
+        return mydocker.get_template(filename)
+
+    def dockerfile_params(self, phase):
+        '''params the Dockerfile template of phase is rendered with'''
+        self.init_act()
+        if phase == 'prepare':
+            return {
+                'base': self.build.base,
+                'workdir': self.workdir,
+                'copy_list': ['.'],
+                'scripts': self.build.prepare.script,
+            }
+        if phase == 'build':
+            return {
+                'base': self.img_names['prepare'],
+                'workdir': self.workdir,
+                'copy_list': ['.'],
+                'scripts': self.build.script,
+                'build_args': [arg.split('=')[0] for arg in self.build.build_arg]
+            }
+        if phase == 'release':
+            return {
+                'base': self.release.dest_base,
+                'workdir': self.workdir,
+                'copy_list': ['.'],
+            }
+        if phase == 'test':
+            return {
+                'base': self.img_names['build'],
+                'workdir': self.workdir,
+                'copy_list': [],
+                'scripts': self.test.script
+            }
+        if phase == 'meta':
+            return {
+                'base': 'scratch',
+                'lain_yaml_path': os.path.basename(self.yaml_path),
+            }
+        raise ValueError('unknown phase {}'.format(phase))
+
+    def release_copies(self):
+        '''(src, dest) of every release.copy entry, as absolute paths'''
+        return [(os.path.join(DOCKER_APP_ROOT, x['src']), os.path.join(DOCKER_APP_ROOT, x['dest']))
+                for x in self.release.copy]
+
+    def multistage_release_params(self):
+        '''params of the multi-stage release Dockerfile, release.script runs
+        in a stage on top of the build image and release.copy entries are
+        copied from there into dest_base'''
+        self.init_act()
+        return {
+            'build': self.img_names['build'],
+            'base': self.release.dest_base,
+            'workdir': self.workdir,
+            'scripts': self.release.script,
+            'build_args': [arg.split('=')[0] for arg in self.build.build_arg],
+            'copies': self.release_copies(),
+        }
+
+    def phase_fingerprint(self, phase, mode='legacy'):
+        '''
+        fingerprint of the inputs of phase build or release the build cache
+        is keyed with, None without a build cache, see input_fingerprint
+        '''
+        if not self.build_cache:
+            return None
+        return self.input_fingerprint(phase, mode=mode)
+
+    def input_fingerprint(self, phase, mode='legacy'):
+        '''
+        fingerprint of the inputs of phase prepare, build or release, see
+        lain_sdk.buildcache. Base images are given by image id, as their
+        names change with every commit. None when a base image is not there
+        locally.
+        '''
+        self.init_act()
+        if phase == 'prepare':
+            base_id = mydocker.image_id(self.build.base)
+            if base_id is None:
+                return None
+            params = dict(self.dockerfile_params('prepare'), base=base_id)
+            return fingerprint({
+                'phase': phase,
+                'dockerfile': mydocker.render_dockerfile(self.img_temps['prepare'], params),
+                # the prepare script runs on a copy of the context, and the
+                # files of keep stay in the image
+                'context': context_digest(self.ctx, self.ignore),
+            })
+        build_args = mydocker.build_arg_flags(self.build.build_arg)
+        if phase == 'build':
+            base_id = mydocker.image_id(self.img_names['prepare'])
+            if base_id is None:
+                return None
+            params = dict(self.dockerfile_params('build'), base=base_id)
+            return fingerprint({
+                'phase': phase,
+                'dockerfile': mydocker.render_dockerfile(self.img_temps['build'], params),
+                'build_args': build_args,
+                'context': context_digest(self.ctx, self.ignore),
+            })
+        if phase == 'release':
+            build_id = mydocker.image_id(self.img_names['build'])
+            dest_base = self.release.dest_base
+            dest_id = mydocker.image_id(dest_base) if dest_base else ''
+            if build_id is None or dest_id is None:
+                return None
+            # the multi-stage Dockerfile describes every release input, whatever the mode
+            params = dict(self.multistage_release_params(), build=build_id, base=dest_id)
+            return fingerprint({
+                'phase': phase,
+                'mode': mode,
+                'dockerfile': mydocker.render_dockerfile(self.load_template(MULTISTAGE_RELEASE_TEMP), params),
+                'build_args': build_args,
+            })
+        raise ValueError('no fingerprint for phase {}'.format(phase))
+
+    def render_dockerfiles(self, phases=PHASES):
+        '''
+        :return: {phase: Dockerfile content}, nothing is written to disk
+        '''
+        return {phase: mydocker.render_dockerfile(self.img_temps[phase], self.dockerfile_params(phase))
+                for phase in phases}
 
     def _get_prepare_shared_image_names(self, remote=True):
         prepare_version = self.build.prepare.version
-        registry = PRIVATE_REGISTRY
+        registry = conf.PRIVATE_REGISTRY
 
         if not registry:
             error("Please set private_docker_registry config first!")
@@ -163,13 +399,14 @@ class LainYaml(object):
         # 如果没有可用的 shared prepare image ，则需要创建一个新的，这里提供新
         # image 的名字
         prepare_version = self.build.prepare.version
-        registry = PRIVATE_REGISTRY
+        registry = conf.PRIVATE_REGISTRY
         image_prefix = "{}/{}".format(registry, self.appname)
         timestamp = int(time.time())
         return "{}:prepare-{}-{}".format(
             image_prefix, prepare_version, timestamp
         )
 
+    @traced('ensure_proper_shared_image')
     def ensure_proper_shared_image(self):
         # 在 registry 以及本地寻找合适可用的 shared prepare
         # 如果找到则保证本地和 registry 里此 image 均可用
@@ -216,6 +453,7 @@ class LainYaml(object):
                 "found no proper shared prepare image neither at local nor remote, rebuild ...")
             return None
 
+    @traced('build_prepare', profile=True)
     def build_prepare(self):
         """
         :return: (True, image_name) or (False, None)
@@ -223,12 +461,7 @@ class LainYaml(object):
         self.init_act()
 
         if (not mydocker.exist(self.img_names['prepare'])):
-            params = {
-                'base': self.build.base,
-                'workdir': self.workdir,
-                'copy_list': ['.'],
-                'scripts': self.build.prepare.script,
-            }
+            params = self.dockerfile_params('prepare')
             name = self.img_builders['prepare'](
                 context=self.ctx, params=params, build_args=[])
             if name is None:
@@ -240,6 +473,7 @@ class LainYaml(object):
         else:
             return (True, self.img_names['prepare'])
 
+    @traced('update_prepare', profile=True)
     def update_prepare(self):
         """
         :return: (True, image_name) or (False, None)
@@ -248,12 +482,7 @@ class LainYaml(object):
 
         # no existed shared prepare
         if (not mydocker.exist(self.img_names['prepare'])):
-            params = {
-                'base': self.build.base,
-                'workdir': self.workdir,
-                'copy_list': ['.'],
-                'scripts': self.build.prepare.script,
-            }
+            params = self.dockerfile_params('prepare')
             name = self.img_builders['prepare'](
                 context=self.ctx, params=params, build_args=[])
             if name is None:
@@ -279,6 +508,7 @@ class LainYaml(object):
 
             return (True, name)
 
+    @traced('build_base', profile=True)
     def build_base(self, use_prepare=False):
         """
         :return: (True, image_name) or (False, None)
@@ -291,26 +521,45 @@ class LainYaml(object):
                 return (False, None)
 
         # image build
-        params = {
-            'base': self.img_names['prepare'],
-            'workdir': self.workdir,
-            'copy_list': ['.'],
-            'scripts': self.build.script,
-            'build_args': [arg.split('=')[0] for arg in self.build.build_arg]
-        }
+        fp = self.phase_fingerprint('build')
+        if fp and self.build_cache.restore(fp, self.img_names['build']):
+            return (True, self.img_names['build'])
+        params = self.dockerfile_params('build')
         name = self.img_builders['build'](context=self.ctx, params=params, build_args=self.build.build_arg)
         if name is None:
             return (False, None)
+        if fp:
+            self.build_cache.store(fp, name)
         return (True, name)
 
-    def build_release(self, use_prepare=False, use_build=False):
+    @traced('build_release', profile=True)
+    def build_release(self, use_prepare=False, use_build=False, mode='legacy'):
         """
+        mode legacy goes through intermediate images and a tar of the release
+        files on the host, mode multistage builds one multi-stage Dockerfile
+        that copies them straight from the build image, mode stream pipes the
+        release files out of the intermediate image into `docker build -`
+
         :return: (True, image_name) or (False, None)
         """
+        if mode not in RELEASE_MODES:
+            raise ValueError('unknown release mode {}, expected one of {}'.format(mode, RELEASE_MODES))
         self.init_act()
         if (not use_build) and (not self.build_base(use_prepare)[0]):
             return (False, None)
 
+        fp = self.phase_fingerprint('release', mode=mode)
+        if fp and self.build_cache.restore(fp, self.img_names['release']):
+            return (True, self.img_names['release'])
+        if mode == 'multistage':
+            result = self._build_release_multistage()
+        else:
+            result = self._build_release_classic(mode)
+        if fp and result[0]:
+            self.build_cache.store(fp, result[1])
+        return result
+
+    def _build_release_classic(self, mode):
         if self.release.script != []:
             params = {
                 'base': self.img_names['build'],
@@ -321,7 +570,8 @@ class LainYaml(object):
             }
             inter_name = self.gen_name(phase='script_inter')
             script_inter_name = mydocker.build(
-                inter_name, self.ctx, self.ignore, self.img_temps['build'], params, self.build.build_arg)
+                inter_name, self.ctx, self.ignore, self.img_temps['build'], params, self.build.build_arg,
+                stream=self.stream_context)
             if script_inter_name is None:
                 return (False, None)
         else:
@@ -344,7 +594,7 @@ class LainYaml(object):
         for src, dest in src_dest:
             copy_scripts.append(' '.join(['mkdir', '-p', os.path.dirname(dest)]))
             copy_scripts.append(' '.join(['cp', '-r', src, dest]))
-        tar_script = ["tar -cf {} -C {} .".format(release_tar, copy_dest)]
+        tar_script = ["tar -cf {} -C {} .".format(release_tar, copy_dest)] if mode == 'legacy' else []
         params = {
             'base': script_inter_name,
             'workdir': self.workdir,
@@ -353,11 +603,13 @@ class LainYaml(object):
         }
         inter_name = self.gen_name(phase='copy_inter')
         copy_inter_name = mydocker.build(
-            inter_name, self.ctx, self.ignore, self.img_temps['build'], params, [])
+            inter_name, self.ctx, self.ignore, self.img_temps['build'], params, [], stream=self.stream_context)
         if script_inter_name != self.img_names['build']:
             mydocker.remove_image(script_inter_name)
         if copy_inter_name is None:
             return (False, None)
+        if mode == 'stream':
+            return self._build_release_stream(copy_inter_name, copy_dest)
 
         try:
             host_release_tar = tempfile.NamedTemporaryFile(dir='/tmp', delete=False).name
@@ -367,14 +619,11 @@ class LainYaml(object):
                 DOCKER_APP_ROOT, release_tar), host_release_tar)
             mydocker.remove_image(copy_inter_name)
 
-            mkdir_p(untar)
-            call(['tar', '-xf', host_release_tar, '-C', untar])
+            with span('untar', path=host_release_tar):
+                mkdir_p(untar)
+                call(['tar', '-xf', host_release_tar, '-C', untar])
 
-            params = {
-                'base': self.release.dest_base,
-                'workdir': self.workdir,
-                'copy_list': ['.'],
-            }
+            params = self.dockerfile_params('release')
             name = self.img_builders['release'](context=untar, params=params, build_args=[])
         except Exception:
             name = None
@@ -388,20 +637,41 @@ class LainYaml(object):
             return (False, None)
         return (True, name)
 
-    def build_test(self):
+    def _build_release_multistage(self):
+        if self.release.script == [] and self.release.dest_base == '':
+            mydocker.tag(self.img_names['build'], self.img_names['release'])
+            return (True, self.img_names['release'])
+
+        name = mydocker.build(
+            self.img_names['release'], None, self.ignore, self.load_template(MULTISTAGE_RELEASE_TEMP),
+            self.multistage_release_params(), self.build.build_arg, stream=self.stream_context)
+        if name is None:
+            return (False, None)
+        return (True, name)
+
+    def _build_release_stream(self, copy_inter_name, copy_dest):
+        container = '{}-release-{}'.format(self.appname, uuid.uuid4().hex[:12])
+        try:
+            mydocker.create(container, copy_inter_name)
+            name = mydocker.stream_build(self.img_names['release'], container, copy_dest,
+                                         self.img_temps['release'], self.dockerfile_params('release'))
+        finally:
+            mydocker.remove_container(container, kill=False)
+            mydocker.remove_image(copy_inter_name)
+        if name is None:
+            return (False, None)
+        return (True, name)
+
+    @traced('build_test', profile=True)
+    def build_test(self, use_build=False):
         """
         :return: (True, image_name) or (False, None)
         """
         self.init_act()
-        if not self.build_base(use_prepare=True)[0]:
+        if (not use_build) and (not self.build_base(use_prepare=True)[0]):
             return (False, None)
 
-        params = {
-            'base': self.img_names['build'],
-            'workdir': self.workdir,
-            'copy_list': [],
-            'scripts': self.test.script
-        }
+        params = self.dockerfile_params('test')
         test_name = self.img_builders['test'](context=self.ctx, params=params, build_args=[])
 
         if test_name is None:
@@ -411,21 +681,159 @@ class LainYaml(object):
             info("Tests Passed")
             return (True, test_name)
 
+    @traced('build_meta', profile=True)
     def build_meta(self):
         """
         :return: (True, image_name) or (False, None)
         """
         self.init_act()
-        params = {
-            'base': 'scratch',
-            'lain_yaml_path': os.path.basename(self.yaml_path),
-        }
+        params = self.dockerfile_params('meta')
         name = self.img_builders['meta'](context=self.ctx, params=params, build_args=[])
         if name is None:
             return (False, None)
         return (True, name)
 
     def tag_meta_version(self, name, sha1=''):
-        tagged = '%s/%s' % (PRIVATE_REGISTRY, name)
+        tagged = '%s/%s' % (conf.PRIVATE_REGISTRY, name)
         mydocker.tag(name, tagged)
         return tagged
+
+
+ParseResult = collections.namedtuple('ParseResult', ['lain_yaml', 'error'])
+
+
+def _load_source(source, context):
+    # runs inside pool workers, errors are sent back instead of raised, and
+    # flattened into ValidationError because not every exception survives
+    # pickling (yaml errors lose their message)
+    try:
+        return LAIN_YAML_SCHEMA.load_with_context(source, context), None
+    except ValidationError as e:
+        return None, ValidationError(e.messages)
+    except Exception as e:
+        return None, ValidationError(f'{e.__class__.__name__}: {e}')
+
+
+def _load_chunk(chunk, context):
+    return [_load_source(source, context) for source in chunk]
+
+
+def _default_context(context):
+    return dict({'meta_version': None, 'domains': [conf.DOMAIN], 'registry': conf.PRIVATE_REGISTRY}, **(context or {}))
+
+
+def parse_many(sources, context=None, workers=None, chunksize=None):
+    '''parse many lain.yaml documents (yaml strings or dicts) in a process pool
+
+    returns a list of ParseResult(lain_yaml, error) in input order, exactly
+    one of the two is None for every document'''
+    context = _default_context(context)
+    sources = list(sources)
+    # LainYaml.raw is always yaml text, like LainYaml.load does for dicts
+    raws = [dump_yaml(source) if isinstance(source, dict) else source for source in sources]
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(sources)) or 1
+    if chunksize is None:
+        # a few chunks per worker keeps the pool busy without paying
+        # pickling overhead for every single document
+        chunksize = max(1, len(sources) // (workers * 4))
+    chunks = [sources[i:i + chunksize] for i in range(0, len(sources), chunksize)]
+    if workers == 1:
+        loaded_chunks = [_load_chunk(chunk, context) for chunk in chunks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            loaded_chunks = list(executor.map(_load_chunk, chunks, [context] * len(chunks)))
+
+    results = []
+    loaded_sources = (result for chunk in loaded_chunks for result in chunk)
+    for raw, (loaded, error) in zip(raws, loaded_sources):
+        if error is not None:
+            results.append(ParseResult(None, error))
+            continue
+        results.append(ParseResult(LainYaml.from_loaded(loaded, raw=raw), None))
+    return results
+
+
+def _document_marker(line):
+    '''--- or ... when line starts with a document marker, else None'''
+    if line[:3] in ('---', '...') and line[3:4] in ('', ' ', '\t', '\r', '\n'):
+        return line[:3]
+    return None
+
+
+def _has_content(lines):
+    for line in lines:
+        if line.startswith('%'):
+            continue
+        # `--- {appname: a}` starts a document with content on the marker line
+        text = (line[3:] if _document_marker(line) else line).strip()
+        if text and not text.startswith('#'):
+            return True
+    return False
+
+
+def _yaml_documents(lines):
+    '''split a multi document yaml stream into the text of its documents
+
+    document markers always start at column 0, so documents can be cut
+    line by line without parsing, one broken document does not take the
+    rest of the stream down with it'''
+    document = []
+    for line in lines:
+        marker = _document_marker(line)
+        if marker:
+            # directives and comments before --- belong to the next document
+            if _has_content(document):
+                yield ''.join(document)
+                document = []
+            else:
+                # the document before this marker is empty, its own ---
+                # would make the next one a stream of two documents
+                document = [line for line in document if not _document_marker(line)]
+            if marker == '...':
+                document = []
+                continue
+        document.append(line)
+    if _has_content(document):
+        yield ''.join(document)
+
+
+def _ndjson_documents(lines):
+    for line in lines:
+        if line.strip():
+            yield line
+
+
+def iter_lain_yamls(stream, context=None, format='yaml'):
+    '''lazily parse a multi document yaml stream, or a NDJSON stream with
+    one lain.yaml per line
+
+    stream can be a file object or any iterable of lines, only one document
+    is held in memory at a time. yields a ParseResult(lain_yaml, error) for
+    every document, exactly one of the two is None'''
+    context = _default_context(context)
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    if format == 'yaml':
+        documents = _yaml_documents(stream)
+    elif format == 'ndjson':
+        documents = _ndjson_documents(stream)
+    else:
+        raise ValueError(f'unknown format {format}, must be yaml or ndjson')
+
+    for raw in documents:
+        if format == 'ndjson':
+            try:
+                source = json.loads(raw)
+            except ValueError as e:
+                yield ParseResult(None, ValidationError(f'{e.__class__.__name__}: {e}'))
+                continue
+        else:
+            source = raw
+        loaded, error = _load_source(source, context)
+        if error is not None:
+            yield ParseResult(None, error)
+        else:
+            yield ParseResult(LainYaml.from_loaded(loaded, raw=raw), None)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+'''
+Build every lain app of a monorepo
+
+    summary = MonorepoBuilder('/path/to/monorepo', max_workers=4).run()
+    print(summary.format())
+
+or from the command line:
+
+    python -m lain_sdk.monorepo /path/to/monorepo --workers 4 --mode multistage
+
+every lain.yaml under the root is an app, apps are built on a thread pool.
+Base images (build.base and release.dest_base) are pulled once no matter how
+many apps use them, and apps whose prepare images have the same inputs (base
+image, prepare script and build context) build it once, the others wait and
+tag it.
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import mydocker
+from .instrument import attach, current_span, span
+from .lain_yaml import RELEASE_MODES, LainYaml
+from .util import error, info, warn
+
+LAIN_YAML = 'lain.yaml'
+SKIP_DIRS = ('.git', '.lain', 'node_modules', 'vendor')
+
+
+def discover(root, filename=LAIN_YAML):
+    '''paths of the lain.yaml files under root, sorted'''
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        if filename in filenames:
+            found.append(os.path.join(dirpath, filename))
+    return sorted(found)
+
+
+class KeyedOnce(object):
+    '''
+    run a function once per key, concurrent callers of the same key wait
+    for the first one and get its result
+
+    >>> once = KeyedOnce()
+    >>> once('golang', lambda: 'pulled'), once('golang', lambda: 'again')
+    ('pulled', 'pulled')
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+        self.results = {}
+
+    def __call__(self, key, func):
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.results:
+                self.results[key] = func()
+            return self.results[key]
+
+
+class AppResult(object):
+
+    def __init__(self, path, appname=None, ok=False, image=None, duration=0.0, error=None):
+        self.path = path
+        self.appname = appname
+        self.ok = ok
+        self.image = image
+        self.duration = duration
+        self.error = error
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class BuildSummary(object):
+
+    def __init__(self, results, wall_time, max_workers):
+        self.results = results
+        self.wall_time = wall_time
+        self.max_workers = max_workers
+
+    @property
+    def ok(self):
+        return all(result.ok for result in self.results)
+
+    @property
+    def serial_time(self):
+        return sum(result.duration for result in self.results)
+
+    def format(self):
+        lines = []
+        for result in self.results:
+            outcome = 'ok' if result.ok else 'failed'
+            detail = result.image if result.ok else (result.error or '')
+            lines.append(f'{result.appname or "?":24} {outcome:6} {result.duration:8.1f}s  {detail}')
+        failed = sum(not result.ok for result in self.results)
+        lines.append(f'{len(self.results)} apps, {failed} failed, wall {self.wall_time:.1f}s, '
+                     f'serial {self.serial_time:.1f}s, {self.max_workers} workers')
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        return {'wall_time': self.wall_time, 'max_workers': self.max_workers,
+                'apps': [result.to_dict() for result in self.results]}
+
+
+class MonorepoBuilder(object):
+
+    def __init__(self, root, max_workers=4, release_mode='legacy', stream_context=False, pull=True,
+                 build_cache=False):
+        if release_mode not in RELEASE_MODES:
+            raise ValueError(f'unknown release mode {release_mode}, expected one of {RELEASE_MODES}')
+        self.root = root
+        self.max_workers = max_workers
+        self.release_mode = release_mode
+        self.stream_context = stream_context
+        self.pull = pull
+        # reuse build and release images of apps whose inputs did not change, see lain_sdk.buildcache
+        self.build_cache = build_cache
+        self.pulls = KeyedOnce()
+        self.prepares = KeyedOnce()
+
+    def pull_base(self, image):
+        '''pull image unless it is there already, once per image for all apps'''
+        if not image or image == 'scratch':
+            return True
+        return self.pulls(image, lambda: mydocker.exist(image) or mydocker.pull(image) == 0)
+
+    def build_prepare(self, lain_yaml):
+        '''apps whose prepare images are made of the same inputs build one
+        of them, the others tag it with their own prepare image name. The
+        build context is one of the inputs, so this dedupes apps with the
+        same context files, like several lain.yaml variants of one app'''
+        name = lain_yaml.img_names['prepare']
+        if mydocker.exist(name):
+            return True
+        key = lain_yaml.input_fingerprint('prepare') or name
+        built = self.prepares(key, lambda: lain_yaml.build_prepare()[1])
+        if built is None:
+            return False
+        if built == name:
+            return True
+        if mydocker.tag(built, name) != 0:
+            return False
+        if mydocker.push(name) != 0:
+            warn(f'FAILED: docker push {name}')
+        return True
+
+    def build_app(self, path):
+        result = AppResult(path)
+        start = time.perf_counter()
+        try:
+            with span('monorepo.app', path=path) as s:
+                lain_yaml = LainYaml(lain_yaml_path=path, stream_context=self.stream_context,
+                                     build_cache=self.build_cache or None)
+                result.appname = s.attributes['appname'] = lain_yaml.appname
+                if self.pull:
+                    for image in (lain_yaml.build.base, lain_yaml.release.dest_base):
+                        if not self.pull_base(image):
+                            raise Exception(f'failed to pull {image}')
+                if not self.build_prepare(lain_yaml):
+                    raise Exception('prepare failed')
+                result.ok, result.image = lain_yaml.build_release(use_prepare=True, mode=self.release_mode)
+                if not result.ok:
+                    result.error = 'release failed'
+        except (Exception, SystemExit) as e:
+            # lain_yaml exits on missing configs, that must not stop the other apps
+            error(f'building {path} failed: {e!r}')
+            result.ok, result.error = False, str(e) or repr(e)
+        result.duration = time.perf_counter() - start
+        return result
+
+    def run(self, paths=None):
+        paths = discover(self.root) if paths is None else paths
+        info(f'building {len(paths)} apps with {self.max_workers} workers ...')
+        start = time.perf_counter()
+        with span('monorepo', root=self.root, apps=len(paths)):
+            parent = current_span()
+
+            def build(path):
+                with attach(parent):
+                    return self.build_app(path)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(build, paths))
+        return BuildSummary(results, time.perf_counter() - start, self.max_workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='build the release image of every lain app under a directory')
+    parser.add_argument('root', help='directory searched for lain.yaml files')
+    parser.add_argument('--workers', type=int, default=4, help='apps built at the same time, default 4')
+    parser.add_argument('--mode', choices=RELEASE_MODES, default='legacy', help='release mode, default legacy')
+    parser.add_argument('--stream-context', action='store_true',
+                        help='send build contexts from python instead of writing into the repo')
+    parser.add_argument('--build-cache', action='store_true',
+                        help='tag images built from unchanged inputs instead of building them again')
+    args = parser.parse_args(argv)
+
+    summary = MonorepoBuilder(args.root, max_workers=args.workers, release_mode=args.mode,
+                              stream_context=args.stream_context, build_cache=args.build_cache).run()
+    print(summary.format())
+    return 0 if summary.ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
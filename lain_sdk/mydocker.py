@@ -1,25 +1,60 @@
 # -*- coding: utf-8 -*-
 import os
 import shutil
+import io
 import subprocess
+import tarfile
 import tempfile
+import threading
 import time
+from contextlib import contextmanager
+from functools import lru_cache
 
-import docker
-import requests
-from jinja2 import Template
-
-from .util import (REGISTRY_CONNECT_TIMEOUT, REGISTRY_READ_TIMEOUT, error,
+from .instrument import span, traced
+from .util import (REGISTRY_CONNECT_TIMEOUT, REGISTRY_READ_TIMEOUT, error, get_cfd,
                    get_jwt_for_registry, info, mkdir_p, parse_registry_auth,
                    recur_create_file, rm)
 
 DOCKER_BASE_URL = os.environ.get('DOCKER_HOST', '')
+TEMPLATE_DIR = os.path.join(get_cfd(__file__), 'yaml/templates')
+
+# context dir -> [ignore, number of builds using its .dockerignore]
+_dockerignores = {}
+_dockerignores_changed = threading.Condition()
 
 # Assume `docker` can be run without `sudo`
 
 # docker_reg set through param or env LAIN_DOCKER_REGISTRY
 
 
+SECRET_FLAGS = ('-p', '--password')
+REDACTED = '***'
+
+
+def redact_args(args):
+    """
+    args of a docker command with the values of build args and passwords
+    replaced, safe to put in a span
+
+    >>> redact_args(['build', '--build-arg', 'TOKEN=abc', '-t', 'hello', '.'])
+    ['build', '--build-arg', 'TOKEN=***', '-t', 'hello', '.']
+    """
+    redacted = []
+    flag = None
+    for arg in args:
+        if flag == '--build-arg':
+            arg = arg.split('=', 1)[0] + '=' + REDACTED
+        elif flag in SECRET_FLAGS:
+            arg = REDACTED
+        elif arg.startswith('--build-arg='):
+            arg = '--build-arg=' + arg[len('--build-arg='):].split('=', 1)[0] + '=' + REDACTED
+        elif arg.startswith('--password='):
+            arg = '--password=' + REDACTED
+        flag = arg
+        redacted.append(arg)
+    return redacted
+
+
 def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=True):
     """
     Wrapper of Docker client. Use subprocess instead of docker-py to
@@ -39,18 +74,19 @@ def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=T
 
     cmd = ['docker'] + args
     env = dict(env, DOCKER_HOST='')
-
-    if capture_output:
-        try:
-            output = subprocess.check_output(
-                cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            output = e.output
-        return output.decode()
-    else:
-        retcode = subprocess.call(cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT,
-                                  stdout=(None if print_stdout else open('/dev/null', 'w')))
-        return retcode
+    with span('docker.' + args[0], args=redact_args(args)) as s:
+        if capture_output:
+            try:
+                output = subprocess.check_output(
+                    cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError as e:
+                output = e.output
+            return output.decode()
+        else:
+            retcode = subprocess.call(cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT,
+                                      stdout=(None if print_stdout else open('/dev/null', 'w')))
+            s.attributes['retcode'] = retcode
+            return retcode
 
 
 def gen_image_name(appname, phase, meta_version=None, registry=None):
@@ -71,13 +107,41 @@ def get_phase(img_name):
     return img_name.split(':')[1].split('-')[0]
 
 
+@lru_cache(maxsize=None)
+def template_env():
+    '''
+    jinja2 environment shared by the whole process, templates in TEMPLATE_DIR
+    are compiled once and their bytecode is kept on disk for the next process
+    '''
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    return Environment(loader=FileSystemLoader(TEMPLATE_DIR), bytecode_cache=FileSystemBytecodeCache(),
+                       auto_reload=False)
+
+
+def get_template(filename):
+    return template_env().get_template(filename)
+
+
+@lru_cache(maxsize=64)
+def compile_template(source):
+    return template_env().from_string(source)
+
+
+def render_dockerfile(template, dockerfile_params):
+    '''template is either a compiled template or the source of one'''
+    if isinstance(template, str):
+        template = compile_template(template)
+    return template.render(dockerfile_params)
+
+
 def gen_dockerfile(dockerfile_path, template, dockerfile_params):
     info('generating dockerfile to {}'.format(dockerfile_path))
 
     recur_create_file(dockerfile_path)
 
     with open(dockerfile_path, 'w') as f:
-        f.write(Template(template).render(dockerfile_params))
+        f.write(render_dockerfile(template, dockerfile_params))
 
 
 def gen_dockerignore(path, ignore):
@@ -97,24 +161,29 @@ def gen_dockerignore(path, ignore):
         f.write('# end of lain\n')
 
 
-def build_image(name, context, build_args):
-    info('building image {} ...'.format(name))
-    docker_args = ['build', '-t', name, '.']
-
+def build_arg_flags(build_args):
     if 'docker_http_proxy' in os.environ:
         build_args = [
             'http_proxy=$docker_http_proxy', 'https_proxy=$docker_http_proxy'
         ]
 
-    if build_args:
-        docker_args = ['build', '-t', name]
-        for arg in build_args:
-            key, val = arg.split('=', 1)
-            if val.startswith('$'):
-                val = os.environ[val[1:]]
-            docker_args.append('--build-arg')
-            docker_args.append('{}={}'.format(key, val))
-        docker_args.append('.')
+    flags = []
+    for arg in build_args:
+        key, val = arg.split('=', 1)
+        if val.startswith('$'):
+            val = os.environ[val[1:]]
+        flags.append('--build-arg')
+        flags.append('{}={}'.format(key, val))
+    return flags
+
+
+def build_image(name, context, build_args, dockerfile=None):
+    info('building image {} ...'.format(name))
+    docker_args = ['build', '-t', name]
+    if dockerfile is not None:
+        docker_args += ['-f', dockerfile]
+    docker_args += build_arg_flags(build_args)
+    docker_args.append('.')
     retcode = _docker(docker_args, cwd=context)
     if retcode != 0:
         name = None
@@ -124,23 +193,161 @@ def build_image(name, context, build_args):
     return name
 
 
-def build(name, context, ignore, template, params, build_args):
-    dockerfile_path = os.path.join(context, 'Dockerfile')
-    dockerignore_path = os.path.join(context, '.dockerignore')
-    dockerignore_backup = os.path.join(context, '.dockerignore.backup')
+@contextmanager
+def shared_dockerignore(context, ignore):
+    """
+    .dockerignore of context with ignore appended, for the duration of the
+    block. Concurrent builds of the same context share the file, the original
+    one is restored after the last of them; a build with a different ignore
+    list waits until then.
+    """
+    path = os.path.join(context, '.dockerignore')
+    backup_path = os.path.join(context, '.dockerignore.backup')
+    key = os.path.realpath(context)
+    ignore = tuple(ignore)
+    with _dockerignores_changed:
+        _dockerignores_changed.wait_for(lambda: _dockerignores.get(key, [ignore])[0] == ignore)
+        if key in _dockerignores:
+            _dockerignores[key][1] += 1
+        else:
+            _dockerignores[key] = [ignore, 1]
+            try:
+                gen_dockerignore(path, ignore)
+            except Exception:
+                del _dockerignores[key]
+                raise
+    try:
+        yield path
+    finally:
+        with _dockerignores_changed:
+            _dockerignores[key][1] -= 1
+            if _dockerignores[key][1] == 0:
+                del _dockerignores[key]
+                if os.path.exists(path):
+                    rm(path)
+                if os.path.exists(backup_path):
+                    shutil.move(backup_path, path)
+                _dockerignores_changed.notify_all()
+
+
+def build(name, context, ignore, template, params, build_args, stream=False):
+    """
+    context None builds with a context holding nothing but the Dockerfile,
+    for Dockerfiles that only copy from other images. stream=True sends
+    the context from python instead, see context_build.
+    """
+    if stream:
+        return context_build(name, context, ignore, template, params, build_args)
+    # the Dockerfile lives outside of the context, so that builds of the same
+    # context can run at the same time
+    dockerfile_dir = tempfile.mkdtemp(prefix='lain-dockerfile-')
+    dockerfile_path = os.path.join(dockerfile_dir, 'Dockerfile')
     try:
         gen_dockerfile(dockerfile_path, template, params)
-        gen_dockerignore(dockerignore_path, ignore)
-        name = build_image(name, context, build_args)
+        if context is None:
+            name = build_image(name, dockerfile_dir, build_args, dockerfile=dockerfile_path)
+        else:
+            with shared_dockerignore(context, ignore):
+                name = build_image(name, context, build_args, dockerfile=dockerfile_path)
+    finally:
+        rm(dockerfile_dir)
+    return name
+
+
+def relay_context(archive, out, dockerfile, prefix, bufsize=64 * 1024):
+    """
+    turn the tar stream of `docker cp <container>:<dir> -` into a build
+    context: prefix/ (the basename of dir) is stripped from every member,
+    and a Dockerfile plus a .dockerignore keeping both out of the image are
+    put in front. Members are copied one by one in bufsize chunks, neither
+    side is seeked or held in memory.
+    """
+    with tarfile.open(fileobj=out, mode='w|', bufsize=bufsize) as dst:
+        for filename, content in (('Dockerfile', dockerfile), ('.dockerignore', 'Dockerfile\n.dockerignore\n')):
+            data = content.encode()
+            tarinfo = tarfile.TarInfo(filename)
+            tarinfo.size, tarinfo.mtime = len(data), int(time.time())
+            dst.addfile(tarinfo, io.BytesIO(data))
+
+        with tarfile.open(fileobj=archive, mode='r|', bufsize=bufsize) as src:
+            for member in src:
+                name = member.name.rstrip('/')
+                if name == prefix:
+                    continue
+                if not name.startswith(prefix + '/'):
+                    raise ValueError('unexpected member {} in archive of {}'.format(member.name, prefix))
+                member.name = name[len(prefix) + 1:]
+                if member.islnk() and member.linkname.startswith(prefix + '/'):
+                    member.linkname = member.linkname[len(prefix) + 1:]
+                dst.addfile(member, src.extractfile(member) if member.isreg() else None)
+
+
+def _docker_popen(args, **kwargs):
+    return subprocess.Popen(['docker'] + args, env=dict(os.environ, DOCKER_HOST=''), **kwargs)
+
+
+def _build_from_stdin(name, build_args, write_context):
+    """run `docker build -`, write_context(stdin) writes the context tar"""
+    builder = _docker_popen(['build', '-t', name] + build_arg_flags(build_args) + ['-'],
+                            stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
+    sent = True
+    try:
+        write_context(builder.stdin)
+    except (OSError, tarfile.TarError, ValueError) as e:
+        error('sending the build context of {} failed: {!r}'.format(name, e))
+        builder.kill()
+        sent = False
     finally:
-        for path in [dockerfile_path, dockerignore_path]:
-            if os.path.exists(path):
-                rm(path)
-        if os.path.exists(dockerignore_backup):
-            shutil.move(dockerignore_backup, dockerignore_path)
+        try:
+            builder.stdin.close()
+        except OSError:
+            pass
+    if builder.wait() != 0 or not sent:
+        error('build failed. See errors above.')
+        return None
+    info('build succeeded: {}'.format(name))
     return name
 
 
+def stream_build(name, container, path, template, params, build_args=()):
+    """
+    build image name from directory path of container, the files are piped
+    from `docker cp` into `docker build -` without touching the disk
+    """
+    info('building image {} from {}:{} ...'.format(name, container, path))
+    dockerfile = render_dockerfile(template, params)
+    prefix = os.path.basename(path.rstrip('/'))
+    with span('docker.stream_build', image=name, source='{}:{}'.format(container, path)) as s:
+        source = _docker_popen(['cp', '{}:{}'.format(container, path), '-'], stdout=subprocess.PIPE)
+        try:
+            name = _build_from_stdin(
+                name, build_args, lambda stdin: relay_context(source.stdout, stdin, dockerfile, prefix))
+        finally:
+            # docker cp gets a broken pipe if the build stopped reading early
+            source.stdout.close()
+        retcode = s.attributes['retcode'] = source.wait()
+    if retcode != 0:
+        error('docker cp {}:{} failed'.format(container, path))
+        return None
+    return name
+
+
+def context_build(name, context, ignore, template, params, build_args):
+    """
+    like build, but the context tar is made in python and piped into
+    `docker build -`: nothing is written into context, so any number of
+    builds can share one checkout. See lain_sdk.buildcontext.
+    """
+    from .buildcontext import build_context
+
+    info('building image {} ...'.format(name))
+    dockerfile = render_dockerfile(template, params)
+    with span('docker.context_build', image=name, context=context) as s:
+        def write_context(stdin):
+            s.attributes['paths'] = build_context(context, stdin, dockerfile, ignore)
+        return _build_from_stdin(name, build_args, write_context)
+
+
 def remove_container(container_id, kill=True):
     info('removing container {} ...'.format(container_id))
     if kill:
@@ -267,6 +474,12 @@ def tag(src, dest):
     return retcode
 
 
+def image_id(name):
+    """id (sha256:...) of local image name, None if there is no such image"""
+    output = _docker(['image', 'inspect', '--format', '{{.Id}}', name], capture_output=True).strip()
+    return output if output.startswith('sha256:') else None
+
+
 def exist(name):
     retcode = _docker(['inspect', name], print_stdout=False)
     return retcode == 0
@@ -303,7 +516,10 @@ def logout(registry=None):
     _docker(['logout', registry])
 
 
+@traced('registry.tags')
 def get_tag_list_in_registry(registry, appname):
+    import requests
+
     tag_list_url = "http://%s/v2/%s/tags/list" % (registry, appname)
     need_auth, auth_url = parse_registry_auth(registry)
     if need_auth:
@@ -319,7 +535,10 @@ def get_tag_list_in_registry(registry, appname):
         return []
 
 
+@traced('daemon.tags')
 def get_tag_list_in_docker_daemon(registry, appname):
+    import docker
+
     tag_list = []
     c = docker.from_env(version='auto')
     imgs = c.images.list()
@@ -337,6 +556,8 @@ def get_tag_list_in_docker_daemon(registry, appname):
 
 
 def get_tag_list_using_by_containers(registry, appname):
+    import docker
+
     tag_list = []
     c = docker.from_env(version='auto')
     containers = c.containers.list()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+'''
+Run the build phases of a LainYaml as a DAG
+
+every phase is a node with the phases it depends on, phases whose
+dependencies are done run at the same time on a thread pool:
+
+    result = Pipeline(lain_yaml, phases=('release', 'test', 'meta'), mode='multistage').run()
+    result.results['release']     # (True, image_name) or (False, None)
+    result.critical_path          # ['prepare', 'build', 'release']
+
+asking for a phase also runs everything it depends on. When a phase fails,
+the phases that depend on it are skipped and get (False, None). A phase
+reuses the image of a phase it depends on only when that is the image it
+builds on, otherwise it builds its dependencies again like a standalone
+build_* call does.
+'''
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .instrument import attach, span
+from .lain_yaml import RELEASE_MODES
+
+# phase -> phases it needs
+DEPENDENCIES = {
+    'prepare': (),
+    'build': ('prepare', ),
+    'release': ('build', ),
+    'test': ('build', ),
+    'meta': (),
+}
+
+
+def built(results, phase, image):
+    '''whether phase is done and built image'''
+    return results.get(phase) == (True, image)
+
+
+def default_tasks(mode='legacy'):
+    '''phase -> function(lain_yaml, results) returning (True, image_name) or
+    (False, None), results holds those of the finished phases. The release
+    image is built in release mode mode'''
+    if mode not in RELEASE_MODES:
+        raise ValueError(f'unknown release mode {mode}, expected one of {RELEASE_MODES}')
+    return {
+        'prepare': lambda y, results: y.build_prepare(),
+        'build': lambda y, results: y.build_base(
+            use_prepare=built(results, 'prepare', y.img_names['prepare'])),
+        'release': lambda y, results: y.build_release(
+            use_prepare=True, use_build=built(results, 'build', y.img_names['build']), mode=mode),
+        'test': lambda y, results: y.build_test(use_build=built(results, 'build', y.img_names['build'])),
+        'meta': lambda y, results: y.build_meta(),
+    }
+
+
+TASKS = default_tasks()
+
+FAILED = (False, None)
+
+
+class PipelineResult(object):
+
+    def __init__(self, results, durations, dependencies, wall_time):
+        # phase -> (True, image_name) or (False, None)
+        self.results = results
+        # phase -> seconds, skipped phases are left out
+        self.durations = durations
+        self.wall_time = wall_time
+        self.critical_path, self.critical_path_time = critical_path(durations, dependencies)
+
+    @property
+    def ok(self):
+        return all(ok for ok, _ in self.results.values())
+
+    @property
+    def serial_time(self):
+        '''time the phases would have taken one after another'''
+        return sum(self.durations.values())
+
+    def summary(self):
+        lines = [f'{phase:8} {"ok" if self.results[phase][0] else "failed":6} '
+                 f'{self.durations.get(phase, 0):8.2f}s' for phase in self.results]
+        lines.append(f'critical path {" -> ".join(self.critical_path)}: {self.critical_path_time:.2f}s, '
+                     f'wall {self.wall_time:.2f}s, serial {self.serial_time:.2f}s')
+        return '\n'.join(lines)
+
+
+def critical_path(durations, dependencies):
+    '''
+    longest chain of dependent phases, by duration
+
+    >>> critical_path({'a': 1, 'b': 3, 'c': 1}, {'a': (), 'b': ('a', ), 'c': ('a', )})
+    (['a', 'b'], 4)
+    '''
+    finish, previous = {}, {}
+
+    def finish_time(phase):
+        if phase not in finish:
+            deps = [dep for dep in dependencies.get(phase, ()) if dep in durations]
+            before = max(deps, key=finish_time, default=None)
+            previous[phase] = before
+            finish[phase] = durations[phase] + (finish_time(before) if before else 0)
+        return finish[phase]
+
+    last = max(durations, key=finish_time, default=None)
+    path = []
+    while last is not None:
+        path.append(last)
+        last = previous[last]
+    return path[::-1], finish[path[0]] if path else 0
+
+
+def resolve(phases, dependencies):
+    '''phases with everything they depend on, in dependency order'''
+    ordered, visiting = [], set()
+
+    def visit(phase):
+        if phase in ordered:
+            return
+        if phase not in dependencies:
+            raise ValueError(f'unknown phase {phase}')
+        if phase in visiting:
+            raise ValueError(f'dependency cycle through phase {phase}')
+        visiting.add(phase)
+        for dep in dependencies[phase]:
+            visit(dep)
+        visiting.discard(phase)
+        ordered.append(phase)
+
+    for phase in phases:
+        visit(phase)
+    return ordered
+
+
+class Pipeline(object):
+
+    def __init__(self, lain_yaml, phases=None, dependencies=DEPENDENCIES, tasks=None, max_workers=2, mode=None):
+        '''mode is the release mode of the default tasks, it can not be
+        combined with tasks'''
+        if tasks is not None and mode is not None:
+            raise ValueError('mode only applies to the default tasks')
+        self.lain_yaml = lain_yaml
+        self.dependencies = dependencies
+        self.tasks = default_tasks(mode or 'legacy') if tasks is None else tasks
+        self.phases = resolve(phases or list(dependencies), dependencies)
+        self.max_workers = max_workers
+
+    def run(self):
+        # shared prepare image lookup and image names, once before any thread starts
+        self.lain_yaml.init_act()
+        results, durations = {}, {}
+        lock = threading.Lock()
+        pending = list(self.phases)
+        start = time.perf_counter()
+
+        with span('pipeline', phases=self.phases) as pipeline_span, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while pending or running:
+                for phase in list(pending):
+                    deps = self.dependencies[phase]
+                    if any(dep not in results for dep in deps):
+                        continue
+                    pending.remove(phase)
+                    if not all(results[dep][0] for dep in deps):
+                        with lock:
+                            results[phase] = FAILED
+                        continue
+                    future = executor.submit(self._run_phase, phase, results, durations, lock, pipeline_span)
+                    running[future] = phase
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    phase = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        pipeline_span.attributes.setdefault('errors', {})[phase] = repr(e)
+                        result = FAILED
+                    with lock:
+                        results[phase] = result
+
+        results = {phase: results[phase] for phase in self.phases}
+        return PipelineResult(results, durations, self.dependencies, time.perf_counter() - start)
+
+    def _run_phase(self, phase, results, durations, lock, parent):
+        with lock:
+            done = dict(results)
+        start = time.perf_counter()
+        try:
+            with attach(parent), span('pipeline.' + phase):
+                return self.tasks[phase](self.lain_yaml, done) or FAILED
+        finally:
+            with lock:
+                durations[phase] = time.perf_counter() - start
@@ -10,14 +10,8 @@ import shutil
 import subprocess
 from sys import stderr
 
-import requests
-from docker import auth
-from requests.auth import HTTPBasicAuth
-
 from six import iteritems
 
-from .yaml.conf import user_config
-
 
 class RichEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -104,6 +98,8 @@ REGISTRY_READ_TIMEOUT = 5
 
 
 def parse_registry_auth(registry):
+    import requests
+
     need_auth, auth_url = False, ''
     registry_url = "http://%s/v2" % registry
     try:
@@ -132,6 +128,10 @@ def _get_registry_auth_url(response):
 
 
 def get_jwt_for_registry(auth_url, registry, appname):
+    import requests
+    from docker import auth
+    from requests.auth import HTTPBasicAuth
+
     # get auth username and password from dockercfg
     try:
         cfg = auth.resolve_authconfig(auth.load_config(), registry=registry)
@@ -171,3 +171,53 @@ def meta_version(repo_dir, sha1=''):
         return None
 
     return commit_hash.decode()
+
+
+def _read_ref(git_dir, ref):
+    path = os.path.join(git_dir, ref)
+    if os.path.isfile(path):
+        with open(path) as f:
+            return f.read().strip()
+    packed_refs = os.path.join(git_dir, 'packed-refs')
+    if os.path.isfile(packed_refs):
+        with open(packed_refs) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+def git_head(repo_dir):
+    """sha1 of HEAD of the git repo containing repo_dir, read from .git
+    without running git, None if it cannot be found"""
+    path = os.path.abspath(repo_dir)
+    if not os.path.isdir(path):
+        path = os.path.dirname(path)
+    while True:
+        git_dir = os.path.join(path, '.git')
+        if os.path.exists(git_dir):
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+    try:
+        if os.path.isfile(git_dir):
+            # worktrees and submodules: "gitdir: <path>"
+            with open(git_dir) as f:
+                git_dir = os.path.join(path, f.read().split(':', 1)[1].strip())
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref:'):
+            return head
+        ref = head[4:].strip()
+        sha1 = _read_ref(git_dir, ref)
+        commondir = os.path.join(git_dir, 'commondir')
+        if sha1 is None and os.path.isfile(commondir):
+            with open(commondir) as f:
+                sha1 = _read_ref(os.path.join(git_dir, f.read().strip()), ref)
+        return sha1
+    except (IOError, IndexError):
+        return None
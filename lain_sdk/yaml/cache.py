@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from lain_sdk import __version__
+from lain_sdk.util import git_head, meta_version
+
+from .parser import Proc, ProcType, SocketType
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+MANIFEST_CACHE_PATH = os.path.join('.lain', 'cache', 'lain.yaml.json')
+# files modified this close to the moment their entry was written may have
+# changed again without changing mtime, they are always hashed
+RACY_NS = 2 * 10 ** 9
+
+
+def context_key(context):
+    domains = context.get('domains')
+    return [context.get('meta_version'), None if domains is None else list(domains), context.get('registry')]
+
+
+def dump_loaded(loaded):
+    '''a loaded lain.yaml as plain json data, see restore_loaded'''
+    procs = {}
+    for name, proc in loaded['procs'].items():
+        proc = dict(proc, type=proc['type'].name)
+        # ports are keyed by their own port number
+        proc['port'] = [dict(port, type=port['type'].name) for port in proc['port'].values()]
+        procs[name] = proc
+    return dict(loaded, procs=procs)
+
+
+def restore_loaded(data):
+    '''the loaded lain.yaml dumped by dump_loaded'''
+    procs = {}
+    for name, proc in data['procs'].items():
+        proc['type'] = ProcType[proc['type']]
+        proc['port'] = {port['port']: dict(port, type=SocketType[port['type']]) for port in proc['port']}
+        proc['system_volumes'] = tuple(proc['system_volumes'])
+        procs[name] = Proc(proc)
+    return dict(data, procs=procs)
+
+
+class ParseCache(object):
+    """
+    Content addressed LRU cache for parsed lain.yaml
+
+    Entries are keyed by the hash of the raw yaml text plus the schema context
+    (meta_version, domains, registry), and stored pickled, so that every hit
+    hands out a fresh copy that the caller is free to mutate, and the byte
+    size of an entry is simply the length of its pickle.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(raw, context):
+        digest = hashlib.sha256(raw.encode('utf-8'))
+        digest.update(json.dumps(context_key(context)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return pickle.loads(blob)
+
+    def put(self, key, loaded):
+        blob = pickle.dumps(loaded, pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[key] = blob
+            self.bytes += len(blob)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_or_load(self, raw, context, loader):
+        '''return the cached parse result of raw, call loader() on miss
+
+        errors raised by loader are never cached'''
+        key = self.make_key(raw, context)
+        loaded = self.get(key)
+        if loaded is None:
+            loaded = loader()
+            self.put(key, loaded)
+        return loaded
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+        }
+
+
+class ManifestCache(object):
+    """
+    On-disk cache of a parsed lain.yaml, stored next to it in
+    .lain/cache/lain.yaml.json
+
+    The entry lives in the checkout, so it is plain json and never
+    unpickled: reading it can not run code, only load a lain.yaml.
+
+    The single entry is valid for the SDK version and schema context it was
+    written with. Its lain.yaml is first compared by mtime and size, and
+    only hashed when those changed. When no meta_version is given, it is
+    reused from the entry as long as git HEAD did not move, which is read
+    from .git without running git. A fresh entry means no yaml parsing,
+    validation or git process at all.
+    """
+
+    def __init__(self, lain_yaml_path, path=None):
+        self.lain_yaml_path = os.path.abspath(lain_yaml_path)
+        self.repo_dir = os.path.dirname(self.lain_yaml_path)
+        self.path = path or os.path.join(self.repo_dir, MANIFEST_CACHE_PATH)
+        self.hit = None
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+            if not isinstance(entry, dict) or entry.get('sdk_version') != __version__:
+                return None
+            entry['loaded'] = restore_loaded(entry['loaded'])
+        except Exception:
+            return None
+        return entry
+
+    def write(self, entry):
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            ignore = os.path.join(directory, '.gitignore')
+            if not os.path.exists(ignore):
+                with open(ignore, 'w') as f:
+                    f.write('# created by lain_sdk\n*\n')
+            # write aside then rename, readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.lain.yaml.json.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(entry, loaded=dump_loaded(entry['loaded'])), f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # the cache is only an optimization, e.g. on a read only checkout
+            pass
+
+    def get_or_load(self, context, loader):
+        '''(raw, loaded) of the lain.yaml, from the cache entry if it is fresh
+
+        loader(raw, context) parses on a miss. if context['meta_version'] is
+        None it is resolved like LainYaml does, with git'''
+        entry = self.read()
+        stat = os.stat(self.lain_yaml_path)
+        stat_key = [stat.st_mtime_ns, stat.st_size]
+        head = git_head(self.repo_dir)
+        context = dict(context)
+        if context.get('meta_version') is None:
+            if entry is not None and head is not None and entry['head'] == head:
+                context['meta_version'] = entry['context'][0]
+            else:
+                context['meta_version'] = meta_version(self.repo_dir)
+
+        raw = None
+        if entry is not None and entry['context'] == context_key(context):
+            if entry['stat'] == stat_key and stat.st_mtime_ns < entry['written_at'] - RACY_NS:
+                self.hit = True
+                return entry['raw'], entry['loaded']
+            raw = self._read_raw()
+            if hashlib.sha256(raw.encode('utf-8')).hexdigest() == entry['sha256']:
+                self.hit = True
+                entry.update(stat=stat_key, head=head, written_at=time.time_ns())
+                self.write(entry)
+                return raw, entry['loaded']
+
+        self.hit = False
+        if raw is None:
+            raw = self._read_raw()
+        loaded = loader(raw, context)
+        self.write({
+            'sdk_version': __version__,
+            'context': context_key(context),
+            'head': head,
+            'stat': stat_key,
+            'sha256': hashlib.sha256(raw.encode('utf-8')).hexdigest(),
+            'written_at': time.time_ns(),
+            'raw': raw,
+            'loaded': loaded,
+        })
+        return raw, loaded
+
+    def _read_raw(self):
+        with open(self.lain_yaml_path) as f:
+            return f.read()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+'''
+Straight-line load functions generated from marshmallow schema declarations
+
+marshmallow sends every field through Field.deserialize, _call_and_store and
+an error store, which dominates the cost of loading lain.yaml files with many
+procs. compile_schema turns the field declarations of a schema instance into
+plain python source doing the same work inline, calling the schema's own
+parse functions, validators and hooks. Only the subset of marshmallow used
+by lain_sdk.yaml.parser is supported, anything else raises CompileError so
+that callers can stay on the marshmallow path.
+
+Generated functions only have to agree with marshmallow on valid input: they
+stop at the first problem with a bare ValidationError, rerun marshmallow to
+get the complete error messages.
+'''
+import itertools
+import linecache
+from collections.abc import Mapping
+
+from marshmallow import RAISE, EXCLUDE, ValidationError, fields, missing
+from marshmallow.decorators import (POST_LOAD, PRE_LOAD, VALIDATES,
+                                    VALIDATES_SCHEMA)
+from marshmallow.utils import get_func_args, is_collection
+from marshmallow.validate import Validator
+from marshmallow_enum import EnumField, LoadDumpOptions
+
+INDENT = '    '
+
+
+class CompileError(Exception):
+    pass
+
+
+class _Generator(object):
+
+    def __init__(self):
+        self.namespace = {
+            'Mapping': Mapping,
+            'ValidationError': ValidationError,
+            'is_collection': is_collection,
+            'missing': missing,
+        }
+        self.functions = []
+        self.compiled = {}
+        self.counter = itertools.count()
+
+    def const(self, value):
+        name = f'_c{next(self.counter)}'
+        self.namespace[name] = value
+        return name
+
+    def var(self):
+        return f'v{next(self.counter)}'
+
+    @staticmethod
+    def fail(field, key, indent):
+        return [f'{indent}raise ValidationError({field.error_messages[key]!r})']
+
+    def hook(self, schema, tag, attr_name):
+        '''code calling a schema hook, see Schema._invoke_processors'''
+        hook = getattr(schema, attr_name)
+        args = ['data' if tag == PRE_LOAD else 'out']
+        if hook.__marshmallow_hook__[(tag, False)].get('pass_original', False):
+            args.append('original')
+        return f'{self.const(hook)}({", ".join(args)})'
+
+    def schema(self, schema, postprocess=True):
+        if id(schema) in self.compiled:
+            return self.compiled[id(schema)]
+        name = f'load_{schema.__class__.__name__}_{next(self.counter)}'
+        self.compiled[id(schema)] = name
+        hooks = schema._hooks
+        if hooks[VALIDATES] or any(hooks[(tag, True)] for tag in (PRE_LOAD, POST_LOAD, VALIDATES_SCHEMA)):
+            raise CompileError(f'{name}: field validators and pass_many hooks are not supported')
+        if schema.many or schema.partial or schema.dict_class is not dict:
+            raise CompileError(f'{name}: many, partial and ordered schemas are not supported')
+        if schema.unknown not in (RAISE, EXCLUDE):
+            raise CompileError(f'{name}: unknown={schema.unknown} is not supported')
+
+        lines = [f'def {name}(data):', f'{INDENT}original = data']
+        for attr_name in hooks[(PRE_LOAD, False)]:
+            lines.append(f'{INDENT}data = {self.hook(schema, PRE_LOAD, attr_name)}')
+        lines.append(f'{INDENT}if data.__class__ is not dict and not isinstance(data, Mapping):')
+        lines.append(f'{INDENT * 2}raise ValidationError({schema.error_messages["type"]!r})')
+        known = frozenset(field.data_key or attr_name
+                          for attr_name, field in schema.fields.items() if not field.dump_only)
+        if schema.unknown == RAISE:
+            lines.append(f'{INDENT}if not {self.const(known)}.issuperset(data):')
+            lines.append(f'{INDENT * 2}raise ValidationError({schema.error_messages["unknown"]!r})')
+        lines.append(f'{INDENT}out = {{}}')
+        for attr_name, field in schema.fields.items():
+            if not field.dump_only:
+                lines.extend(self.field(field, field.data_key or attr_name, field.attribute or attr_name))
+        for attr_name in hooks[(VALIDATES_SCHEMA, False)]:
+            lines.append(f'{INDENT}{self.hook(schema, VALIDATES_SCHEMA, attr_name)}')
+        for attr_name in hooks[(POST_LOAD, False)] if postprocess else ():
+            lines.append(f'{INDENT}out = {self.hook(schema, POST_LOAD, attr_name)}')
+        lines.append(f'{INDENT}return out')
+        self.functions.append('\n'.join(lines))
+        return name
+
+    def field(self, field, key, attribute):
+        '''code loading data[key] into out[attribute], see Field.deserialize'''
+        v = self.var()
+        lines = [f'{INDENT}{v} = data.get({key!r}, missing)', f'{INDENT}if {v} is missing:']
+        if field.required:
+            lines.extend(self.fail(field, 'required', INDENT * 2))
+        elif field.missing is missing:
+            lines.append(f'{INDENT * 2}pass')
+        elif callable(field.missing):
+            lines.append(f'{INDENT * 2}out[{attribute!r}] = {self.const(field.missing)}()')
+        else:
+            lines.append(f'{INDENT * 2}out[{attribute!r}] = {self.const(field.missing)}')
+        lines.append(f'{INDENT}else:')
+        lines.extend(self.value(field, v, f'out[{attribute!r}]', INDENT * 2))
+        return lines
+
+    def value(self, field, src, dst, indent):
+        '''code deserializing and validating a present value src into dst'''
+        lines = [f'{indent}if {src} is None:']
+        if field.allow_none:
+            lines.append(f'{indent}{INDENT}{dst} = None')
+            lines.append(f'{indent}else:')
+            indent += INDENT
+        else:
+            lines.extend(self.fail(field, 'null', indent + INDENT))
+        result, deserialize = self.deserialize(field, src, indent)
+        lines.extend(deserialize)
+        for validator in field.validators:
+            if isinstance(validator, Validator):
+                lines.append(f'{indent}{self.const(validator)}({result})')
+            else:
+                lines.append(f'{indent}if {self.const(validator)}({result}) is False:')
+                lines.extend(self.fail(field, 'validator_failed', indent + INDENT))
+        lines.append(f'{indent}{dst} = {result}')
+        return lines
+
+    def deserialize(self, field, src, indent):
+        '''code for field._deserialize, returns (result expression, lines)'''
+        kind = type(field)
+        if kind is fields.String:
+            return src, [f'{indent}if not isinstance({src}, str):'] + self.fail(field, 'invalid', indent + INDENT)
+        if kind is fields.Integer and not field.strict:
+            result = self.var()
+            lines = [f'{indent}if {src} is True or {src} is False:']
+            lines.extend(self.fail(field, 'invalid', indent + INDENT))
+            lines.append(f'{indent}try:')
+            lines.append(f'{indent}{INDENT}{result} = int({src})')
+            lines.append(f'{indent}except (TypeError, ValueError, OverflowError):')
+            lines.extend(self.fail(field, 'invalid', indent + INDENT))
+            return result, lines
+        if kind is fields.Function:
+            func = field.deserialize_func
+            if not func:
+                return src, []
+            if len(get_func_args(func)) > 1:
+                raise CompileError(f'{field.name}: Function fields taking context are not supported')
+            return f'{self.const(func)}({src})', []
+        if kind is EnumField and field.load_by == LoadDumpOptions.name:
+            result = self.var()
+            lines = [f'{indent}if not isinstance({src}, str):']
+            lines.extend(self.fail(field, 'must_be_string', indent + INDENT))
+            # members only, getattr would also find attributes of the enum class
+            lines.append(f'{indent}try:')
+            lines.append(f'{indent}{INDENT}{result} = {self.const(field.enum.__members__)}[{src}]')
+            lines.append(f'{indent}except KeyError:')
+            lines.extend(self.fail(field, 'by_name', indent + INDENT))
+            return result, lines
+        if kind is fields.Nested and not field.many and field.unknown is None:
+            return f'{self.schema(field.schema)}({src})', []
+        if kind is fields.List:
+            result, item, loaded = self.var(), self.var(), self.var()
+            # exact type checks first, the abc checks are slow
+            lines = [f'{indent}if {src}.__class__ is not list and not is_collection({src}):']
+            lines.extend(self.fail(field, 'invalid', indent + INDENT))
+            lines.append(f'{indent}{result} = []')
+            lines.append(f'{indent}for {item} in {src}:')
+            lines.extend(self.value(field.container, item, loaded, indent + INDENT))
+            lines.append(f'{indent}{INDENT}{result}.append({loaded})')
+            return result, lines
+        if kind in (fields.Dict, fields.Mapping) and field.key_container is None:
+            lines = [f'{indent}if {src}.__class__ is not dict and not isinstance({src}, Mapping):']
+            lines.extend(self.fail(field, 'invalid', indent + INDENT))
+            if field.value_container is None:
+                return src, lines
+            result, key, item, loaded = self.var(), self.var(), self.var(), self.var()
+            lines.append(f'{indent}{result} = {{}}')
+            lines.append(f'{indent}for {key}, {item} in {src}.items():')
+            lines.extend(self.value(field.value_container, item, loaded, indent + INDENT))
+            lines.append(f'{indent}{INDENT}{result}[{key}] = {loaded}')
+            return result, lines
+        raise CompileError(f'{field.name}: {kind.__name__} is not supported')
+
+
+def compile_schema(schema, postprocess=True):
+    '''generate a load function equivalent to schema.load for valid input
+
+    with postprocess=False the post_load hooks of schema itself are not run,
+    like Schema.validate. The generated source is available as the .source
+    attribute of the result
+    '''
+    generator = _Generator()
+    name = generator.schema(schema, postprocess=postprocess)
+    source = '\n\n\n'.join(generator.functions) + '\n'
+    filename = f'<compiled {schema.__class__.__name__}>'
+    # register the source so that tracebacks through generated code are readable
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    exec(compile(source, filename, 'exec'), generator.namespace)
+    load = generator.namespace[name]
+    load.source = source
+    return load
@@ -1,10 +1,37 @@
+from functools import lru_cache
+
 from lain_sdk.yaml.lain_user_config import LainUserConfig
 
 DOCKER_APP_ROOT = '/lain/app'
 
 user_config = LainUserConfig.create()
-etc = user_config.get_config()
 
-PRIVATE_REGISTRY = None if etc is None else etc.get(
-    'private_docker_registry', None)
-DOMAIN = None if not etc else etc.get('domain', 'lain.local')
+
+@lru_cache(maxsize=None)
+def get_etc():
+    '''lain configs, read on first use instead of at import time'''
+    return user_config.get_config()
+
+
+def get_private_registry():
+    etc = get_etc()
+    return None if etc is None else etc.get('private_docker_registry', None)
+
+
+def get_domain():
+    etc = get_etc()
+    return None if not etc else etc.get('domain', 'lain.local')
+
+
+_LAZY = {
+    'etc': get_etc,
+    'PRIVATE_REGISTRY': get_private_registry,
+    'DOMAIN': get_domain,
+}
+
+
+def __getattr__(name):
+    # conf.DOMAIN and friends keep working, but only read configs when used
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+'''
+Proc level differences between two versions of a parsed lain.yaml
+
+procs are compared through fingerprints of their canonical deploy spec (see
+lain_sdk.yaml.export), with the meta_version masked out of image names so
+that a new release alone does not change any proc. A proc using its own
+image still changes whenever that image does.
+'''
+import collections
+import hashlib
+import json
+
+from .export import loaded_data, proc_spec
+
+AppDiff = collections.namedtuple('AppDiff', ['added', 'removed', 'changed', 'unchanged'])
+META_VERSION_PLACEHOLDER = '{meta_version}'
+
+
+def comparable_spec(proc, meta_version):
+    spec = proc_spec(proc)
+    if meta_version and spec['image']:
+        spec['image'] = spec['image'].replace(meta_version, META_VERSION_PLACEHOLDER)
+    return spec
+
+
+def fingerprint(spec):
+    return hashlib.sha1(json.dumps(spec, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def diff(old, new):
+    '''compare the procs of two LainYaml (or loaded lain.yaml dicts)
+
+    returns AppDiff(added, removed, changed, unchanged), changed maps proc
+    names to the sorted names of the fields that changed, the others are
+    sorted lists of proc names'''
+    old, new = loaded_data(old), loaded_data(new)
+    old_procs, new_procs = old['procs'], new['procs']
+    changed, unchanged = {}, []
+    for name in sorted(old_procs.keys() & new_procs.keys()):
+        old_spec = comparable_spec(old_procs[name], old['meta_version'])
+        new_spec = comparable_spec(new_procs[name], new['meta_version'])
+        if fingerprint(old_spec) == fingerprint(new_spec):
+            unchanged.append(name)
+        else:
+            changed[name] = sorted(field for field in new_spec if old_spec[field] != new_spec[field])
+    return AppDiff(added=sorted(new_procs.keys() - old_procs.keys()),
+                   removed=sorted(old_procs.keys() - new_procs.keys()),
+                   changed=changed,
+                   unchanged=unchanged)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+'''
+Canonical deploy specs of parsed lain.yaml
+
+a deploy spec is built straight from the output of LainYamlSchema.load (or
+LainYaml.loaded), without going through Box, and only contains plain
+dicts, lists, strings and numbers:
+
+    {'appname': ..., 'meta_version': ...,
+     'procs': [{'name': ..., 'type': ..., 'pod_name': ..., ...}, ...]}
+
+procs are sorted by name, every proc has exactly the keys of PROC_FIELDS in
+that order, ports are a list of {'port': ..., 'type': ...} sorted by port.
+msgpack output needs the optional msgpack package.
+'''
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SPEC_VERSION = 1
+PROC_FIELDS = ('name', 'type', 'pod_name', 'image', 'entrypoint', 'cmd', 'num_instances', 'cpu',
+               'memory', 'port', 'mountpoint', 'env', 'volumes', 'system_volumes', 'shared_volumes',
+               'secret_files', 'logs', 'user', 'workdir', 'schedule', 'setup_time', 'kill_timeout')
+
+
+def loaded_data(app):
+    # LainYaml keeps the schema output around, use that instead of its boxes
+    return app if isinstance(app, dict) else app.loaded
+
+
+def proc_spec(proc):
+    spec = {field: proc.get(field) for field in PROC_FIELDS}
+    spec['type'] = proc['type'].name
+    spec['port'] = [{'port': port['port'], 'type': port['type'].name}
+                    for _, port in sorted(proc['port'].items())]
+    spec['system_volumes'] = list(proc['system_volumes'])
+    return spec
+
+
+def deploy_spec(app):
+    '''canonical deploy spec of a LainYaml or a loaded lain.yaml dict'''
+    loaded = loaded_data(app)
+    procs = loaded['procs']
+    return {
+        'spec_version': SPEC_VERSION,
+        'appname': loaded['appname'],
+        'meta_version': loaded['meta_version'],
+        'procs': [proc_spec(procs[name]) for name in sorted(procs)],
+    }
+
+
+def to_json(app):
+    return json.dumps(deploy_spec(app), separators=(',', ':'), ensure_ascii=False)
+
+
+def to_msgpack(app):
+    if msgpack is None:
+        raise ImportError('msgpack export needs the msgpack package, pip install einplus_lain_sdk[msgpack]')
+    return msgpack.packb(deploy_spec(app), use_bin_type=True)
+
+
+def from_msgpack(data):
+    if msgpack is None:
+        raise ImportError('msgpack export needs the msgpack package, pip install einplus_lain_sdk[msgpack]')
+    return msgpack.unpackb(data, raw=False)
+
+
+def write_ndjson(apps, stream):
+    '''write the deploy spec of every app as one line of JSON, returns the
+    number of apps written'''
+    count = 0
+    for app in apps:
+        stream.write(to_json(app))
+        stream.write('\n')
+        count += 1
+    return count
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+Incremental reloading of a lain.yaml that is being edited
+
+IncrementalLoader remembers the top level clauses of the last document it
+loaded, on the next load only sections and proc clauses whose content
+changed are validated again, everything else is reused from the previous
+result. Changes that affect every proc (appname, added or removed sections,
+a different context) and anything that does not validate go through a full
+LainYamlSchema load, so results and errors are always those of a full load.
+'''
+import copy
+
+from .compiled import CompileError, compile_schema
+from .io import load_yaml
+from .parser import LAIN_YAML_SCHEMA
+
+SECTIONS = ('build', 'release', 'test')
+
+
+class IncrementalLoader(object):
+    '''
+    loader = IncrementalLoader(context)
+    loaded = loader.load(open('lain.yaml').read())
+    # edit lain.yaml
+    loaded = loader.load(open('lain.yaml').read())
+
+    unchanged procs are shared between successive results, treat them as
+    read only
+    '''
+
+    def __init__(self, context, schema=LAIN_YAML_SCHEMA):
+        self.context = context
+        self.schema = schema
+        self.clauses = None
+        self.loaded = None
+        # top level keys validated by the last load
+        self.reloaded = set()
+        self._loaders = {}
+
+    def load(self, data):
+        document = copy.deepcopy(data) if isinstance(data, dict) else load_yaml(data)
+        loaded = None
+        if self.loaded is not None and isinstance(document, dict):
+            try:
+                loaded = self._update(document)
+            except Exception:
+                loaded = None
+        if loaded is None:
+            loaded = self.schema.load_with_context(document, self.context)
+            self.reloaded = set(document)
+
+        self.clauses, self.loaded = document, loaded
+        return loaded
+
+    def _loader(self, schema):
+        if schema not in self._loaders:
+            try:
+                self._loaders[schema] = compile_schema(schema)
+            except CompileError:
+                self._loaders[schema] = schema.load
+        return self._loaders[schema]
+
+    def _update(self, document):
+        '''load document by reusing the previous result, None if that is not
+        possible'''
+        previous = self.clauses
+        changed = {key for key in document.keys() | previous.keys()
+                   if key not in document or key not in previous or document[key] != previous[key]}
+        schema = self.schema
+        proc_names = {}
+        for key in changed:
+            _, name = schema.tell_proc_info(key)
+            if name:
+                proc_names[key] = name
+            elif key not in SECTIONS or key not in document or key not in previous:
+                return None
+
+        out = dict(self.loaded)
+        with schema.using_context(self.context):
+            for section in changed.intersection(SECTIONS):
+                out[section] = self._loader(schema.fields[section].schema)(document[section])
+
+            appname = out['appname']
+            default_image, domains = schema.proc_defaults(appname)
+            load_proc = self._loader(schema.fields['procs'].value_container.schema)
+            procs = out['procs'] = {}
+            for key, clause in document.items():
+                if key in proc_names:
+                    name, clause = schema.proc_clause(key, clause)
+                    proc = schema.finalize_proc(load_proc(clause), appname, default_image, domains)
+                else:
+                    _, name = schema.tell_proc_info(key)
+                    if not name:
+                        continue
+                    proc = self.loaded['procs'][name]
+                if name in procs:
+                    # let the full load report duplicate proc names
+                    return None
+                procs[name] = proc
+            schema.warn_mountpoint_clashes(procs)
+
+        self.reloaded = changed
+        return out
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+'''
+The only place lain_sdk reads and writes yaml
+
+libyaml backed loader and dumper are used when PyYAML is built with them,
+they are several times faster than the pure python ones. Only the safe
+variants are used, lain.yaml and lain configs never need python tags.
+'''
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+    LIBYAML = True
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+    LIBYAML = False
+
+YAMLError = yaml.YAMLError
+
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump_yaml(data, stream=None, **kwargs):
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
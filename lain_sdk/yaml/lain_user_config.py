@@ -2,10 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import os
-import yaml
 import stat
 from six import iteritems
 
+from .io import dump_yaml, load_yaml
+
 
 LAIN_USER_CONFIG_FILE_NAME = "lain.conf.yaml"
 LAIN_USER_GLOBAL_CONFIG_FILE_NAME = "global.conf.yaml"
@@ -32,7 +33,7 @@ class LainUserConfig:
     def get_config_from(cls, config_file):
         try:
             with open(config_file) as f:
-                lain_config = yaml.safe_load(f.read())
+                lain_config = load_yaml(f.read())
             return lain_config if lain_config else {}
         except Exception:
             return {}
@@ -66,7 +67,7 @@ class LainUserConfig:
     def save_config(self, config):
         self.ensure_config_path()
         with open(self.user_config_file, "w") as f:
-            f.write(yaml.safe_dump(config, default_flow_style=False))
+            f.write(dump_yaml(config, default_flow_style=False))
             os.chmod(self.user_config_file, stat.S_IREAD|stat.S_IWRITE)
 
     def set_global_config(self, **kwargs):
@@ -79,7 +80,7 @@ class LainUserConfig:
     def save_global_config(self, config):
         self.ensure_config_path()
         with open(self.user_global_config_file, "w") as f:
-            f.write(yaml.safe_dump(config, default_flow_style=False))
+            f.write(dump_yaml(config, default_flow_style=False))
 
     def get_config(self):
         _config = LainUserConfig.get_config_from(
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+'''
+Compact objects for loaded lain.yaml, an alternative to TolerantBox
+
+every class declares its fields in __slots__, attribute names are the same
+as with the Box representation. Lists and dicts inside are the ones from the
+loaded data, they are not copied.
+
+>>> port = Port(type='tcp', port=80)
+>>> port
+Port(type='tcp', port=80)
+>>> port.to_dict()
+{'type': 'tcp', 'port': 80}
+'''
+from .parser import dump_annotation
+
+
+class Model(object):
+    __slots__ = ()
+    # field name -> function converting the loaded value
+    nested = {}
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            if not name.startswith('_'):
+                setattr(self, name, kwargs.get(name))
+
+    @classmethod
+    def from_loaded(cls, data):
+        nested = cls.nested
+        kwargs = {}
+        for name, value in data.items():
+            if name in nested and value is not None:
+                value = nested[name](value)
+            kwargs[name] = value
+        return cls(**kwargs)
+
+    def fields(self):
+        return [name for name in self.__slots__ if not name.startswith('_')]
+
+    def to_dict(self):
+        out = {}
+        for name in self.fields():
+            value = getattr(self, name)
+            if isinstance(value, Model):
+                value = value.to_dict()
+            elif isinstance(value, dict):
+                value = {k: v.to_dict() if isinstance(v, Model) else v for k, v in value.items()}
+            out[name] = value
+        return out
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.fields())
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields())
+        return f'{self.__class__.__name__}({fields})'
+
+
+class Prepare(Model):
+    __slots__ = ('version', 'script', 'keep')
+
+
+class Build(Model):
+    __slots__ = ('base', 'prepare', 'script', 'build_arg')
+    nested = {'prepare': Prepare.from_loaded}
+
+
+class Release(Model):
+    __slots__ = ('script', 'dest_base', 'copy')
+
+
+class Test(Model):
+    __slots__ = ('script', )
+
+
+class Port(Model):
+    __slots__ = ('type', 'port')
+
+
+class Proc(Model):
+    __slots__ = ('name', 'type', 'image', 'entrypoint', 'cmd', 'schedule', 'num_instances', 'cpu',
+                 'memory', 'port', 'mountpoint', 'user', 'workdir', 'env', 'volumes', 'shared_volumes',
+                 'logs', 'secret_files', 'setup_time', 'kill_timeout', 'cloud_volumes', 'system_volumes',
+                 'pod_name', '_annotation', '_keys')
+    nested = {'port': lambda ports: {n: Port.from_loaded(port) for n, port in ports.items()}}
+    # key order of the loaded procs, procs loaded alike share one tuple
+    layouts = {}
+
+    def __init__(self, annotation=None, **kwargs):
+        super(Proc, self).__init__(**kwargs)
+        self._annotation = annotation
+        self._keys = None
+
+    @classmethod
+    def from_loaded(cls, data):
+        proc = super(Proc, cls).from_loaded(data)
+        keys = tuple(key for key in data if key != 'annotation')
+        proc._keys = cls.layouts.setdefault(keys, keys)
+        return proc
+
+    @property
+    def annotation(self):
+        '''json of the proc, serialized on first access. A loaded proc keeps
+        the keys and key order it was loaded with, so this is byte for byte
+        the annotation of a ProcBox'''
+        if self._annotation is None:
+            data = self.to_dict()
+            if self._keys is not None:
+                data = {key: data[key] for key in self._keys}
+            self._annotation = dump_annotation(data)
+        return self._annotation
+
+
+class App(Model):
+    __slots__ = ('appname', 'meta_version', 'build', 'release', 'test', 'procs')
+    nested = {
+        'build': Build.from_loaded,
+        'release': Release.from_loaded,
+        'test': Test.from_loaded,
+        'procs': lambda procs: {name: Proc.from_loaded(proc) for name, proc in procs.items()},
+    }
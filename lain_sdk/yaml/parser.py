@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
+import itertools
 import json
 import os
 import re
+import threading
+import warnings
+from contextlib import contextmanager
 from enum import Enum
+from functools import lru_cache
 from numbers import Number
 
 import humanfriendly
-import yaml
 from marshmallow import (Schema, ValidationError, fields, post_load, pre_load,
                          validate, validates_schema)
 from marshmallow_enum import EnumField
@@ -15,7 +19,10 @@ from lain_sdk.util import RichEncoder
 from six import itervalues, string_types
 
 from ..mydocker import gen_image_name
-from .conf import DOCKER_APP_ROOT, DOMAIN
+from .compiled import CompileError, compile_schema
+from . import conf
+from .conf import DOCKER_APP_ROOT
+from .io import YAMLError, load_yaml
 
 DEFAULT_SYSTEM_VOLUMES = ('/data/lain/entrypoint:/lain/entrypoint:ro', '/etc/localtime:/etc/localtime:ro')
 SOCKET_TYPES = 'tcp udp'
@@ -39,12 +46,18 @@ def parse_version(s):
     return s
 
 
+# manifests use a handful of distinct unit strings ('64m', '10s', '80:tcp'),
+# parse each of them once. lru_cache does not cache exceptions
+_parse_size = lru_cache(maxsize=1024)(humanfriendly.parse_size)
+_parse_timespan = lru_cache(maxsize=1024)(humanfriendly.parse_timespan)
+
+
 def parse_timespan(s):
     if isinstance(s, Number):
         return s
     elif isinstance(s, string_types):
         try:
-            return humanfriendly.parse_timespan(s)
+            return _parse_timespan(s)
         except humanfriendly.InvalidTimespan:
             raise ValidationError(f'failed to parse timespan {s}, you can write int or humanfriendly timespan, see https://humanfriendly.readthedocs.io/en/latest/api.html#humanfriendly.parse_timespan')
     else:
@@ -81,19 +94,26 @@ def parse_port_str(n):
     return n
 
 
+@lru_cache(maxsize=1024)
+def _parse_port_str(p):
+    parts = p.split(':')
+    if not len(parts) == 2:
+        raise ValidationError(f'port declaration should look like 80:tcp, got {p}')
+    port, protocol = parts
+    try:
+        type_ = SocketType[protocol]
+    except KeyError:
+        raise ValidationError(f'weird port protocol: f{protocol}')
+    return parse_port_str(port), type_
+
+
 def parse_port(p):
     if isinstance(p, int):
         dic = {'type': SocketType.tcp, 'port': p}
     elif isinstance(p, string_types):
-        parts = p.split(':')
-        if not len(parts) == 2:
-            raise ValidationError(f'port declaration should look like 80:tcp, got {p}')
-        port, protocol = parts
-        try:
-            type_ = SocketType[protocol]
-        except KeyError:
-            raise ValidationError(f'weird port protocol: f{protocol}')
-        dic = {'type': type_, 'port': parse_port_str(port)}
+        # the result is mutable, only the parsing is cached
+        port, type_ = _parse_port_str(p)
+        dic = {'type': type_, 'port': port}
     else:
         raise ValidationError(f'port must be int or string_types, got {p}')
     # TODO: fix this weird datastructure
@@ -101,7 +121,15 @@ def parse_port(p):
 
 
 def parse_memory(s):
-    return humanfriendly.parse_size(s) if isinstance(s, string_types) else s
+    if not isinstance(s, string_types):
+        return s
+    try:
+        return _parse_size(s)
+    except humanfriendly.InvalidSize:
+        raise ValidationError(f'failed to parse memory {s}, you can write int or humanfriendly size like 64m')
+
+
+DEFAULT_MEMORY = parse_memory('32m')
 
 
 def parse_shared_volumes(s):
@@ -183,7 +211,7 @@ def parse_copy(stuff):
         if 'src' not in stuff:
             raise ValidationError('if copy clause is a dict, it must contain src')
         if 'dest' not in stuff:
-            stuff['dest'] = stuff['src']
+            return dict(stuff, dest=stuff['src'])
 
         return stuff
     raise ValidationError(f'copy clause must be string_types or dict, got {stuff}')
@@ -191,8 +219,8 @@ def parse_copy(stuff):
 
 class PrepareSchema(Schema):
     version = fields.Function(deserialize=parse_version, missing='0')
-    script = fields.List(fields.Str(), missing=[])
-    keep = fields.List(fields.Str(), missing=[])
+    script = fields.List(fields.Str(), missing=list)
+    keep = fields.List(fields.Str(), missing=list)
 
     @post_load
     def finalize(self, data):
@@ -207,41 +235,69 @@ class PrepareSchema(Schema):
 
 class BuildSchema(Schema):
     base = fields.Str(required=True)
-    prepare = fields.Nested(PrepareSchema, missing=PrepareSchema().load({}))
-    script = fields.List(fields.Str(), missing=[])
-    build_arg = fields.List(fields.Str(), missing=[])
+    prepare = fields.Nested(PrepareSchema, missing=lambda: DEFAULT_SCHEMAS['prepare'].load({}))
+    script = fields.List(fields.Str(), missing=list)
+    build_arg = fields.List(fields.Str(), missing=list)
 
 
 class ReleaseSchema(Schema):
-    script = fields.List(fields.Str(), missing=[])
+    script = fields.List(fields.Str(), missing=list)
     dest_base = fields.Str(missing='')
-    copy = fields.List(fields.Function(deserialize=parse_copy), missing=[])
+    copy = fields.List(fields.Function(deserialize=parse_copy), missing=list)
 
 
 class TestSchema(Schema):
-    script = fields.List(fields.Str(), missing=[])
+    script = fields.List(fields.Str(), missing=list)
+
+
+def dump_annotation(proc):
+    # enums are replaced by their names up front, so the C json encoder does
+    # not call back into RichEncoder.default for each of them
+    ports = proc.get('port')
+    data = dict(proc, type=proc['type'].name)
+    if ports:
+        data['port'] = {k: dict(port, type=port['type'].name) for k, port in ports.items()}
+    return json.dumps(data, cls=RichEncoder)
+
+
+class Proc(dict):
+    '''a loaded proc, proc['annotation'] is only serialized on first access
+
+    until then it is not a key, `in`, keys() and iteration leave it out, and
+    it is the json of the proc as it is at that first access'''
+
+    def __missing__(self, key):
+        if key != 'annotation':
+            raise KeyError(key)
+        annotation = self['annotation'] = dump_annotation(self)
+        return annotation
+
+    def get(self, key, default=None):
+        if key == 'annotation':
+            return self[key]
+        return super(Proc, self).get(key, default)
 
 
 class ProcSchema(Schema):
     name = fields.Function(deserialize=parse_proc_name, required=True)
     type_ = EnumField(ProcType, missing=ProcType.worker, data_key='type', attribute='type')
     image = fields.Str(missing='')
-    entrypoint = fields.Function(deserialize=parse_command, missing=[])
+    entrypoint = fields.Function(deserialize=parse_command, missing=list)
     cmd = fields.Function(deserialize=parse_command)
     schedule = fields.Str(missing='')
     num_instances = fields.Int(missing=1)
     cpu = fields.Int(missing=0)
-    memory = fields.Function(deserialize=parse_memory, missing=parse_memory('32m'))
-    port = fields.Function(deserialize=parse_port, missing={})
-    mountpoint = fields.List(fields.Str(), missing=[])
+    memory = fields.Function(deserialize=parse_memory, missing=DEFAULT_MEMORY)
+    port = fields.Function(deserialize=parse_port, missing=dict)
+    mountpoint = fields.List(fields.Str(), missing=list)
     user = fields.Str(missing='')
     workdir = fields.Str(missing='')
-    env = fields.List(fields.Str(validate=validate.Regexp(VALID_ENV_PATTERN)), missing=[])
-    volumes = fields.List(fields.Str(validate=validate_volume), missing=[])
-    persistent_dirs = fields.List(fields.Str(validate=validate_volume), missing=[])
-    shared_volumes = fields.Function(deserialize=parse_shared_volumes, missing={})
-    logs = fields.List(fields.Str(validate=lambda s: not os.path.isabs(s)), missing=[])
-    secret_files = fields.List(fields.Function(deserialize=parse_secret_path), missing=[])
+    env = fields.List(fields.Str(validate=validate.Regexp(VALID_ENV_PATTERN)), missing=list)
+    volumes = fields.List(fields.Str(validate=validate_volume), missing=list)
+    persistent_dirs = fields.List(fields.Str(validate=validate_volume), missing=list)
+    shared_volumes = fields.Function(deserialize=parse_shared_volumes, missing=dict)
+    logs = fields.List(fields.Str(validate=lambda s: not os.path.isabs(s)), missing=list)
+    secret_files = fields.List(fields.Function(deserialize=parse_secret_path), missing=list)
     setup_time = fields.Function(deserialize=parse_timespan, missing=0)
     kill_timeout = fields.Function(deserialize=parse_timespan, missing=10)
 
@@ -268,20 +324,146 @@ class ProcSchema(Schema):
         data['cloud_volumes'] = {}
         # TODO: move functionality to deployd
         data['system_volumes'] = DEFAULT_SYSTEM_VOLUMES
-        return data
+        return Proc(data)
 
 
 class LainYamlSchema(Schema):
     appname = fields.Str(required=True, validate=validate.NoneOf(INVALID_APPNAMES))
     build = fields.Nested(BuildSchema)
-    release = fields.Nested(ReleaseSchema, missing=ReleaseSchema().load({}))
-    test = fields.Nested(TestSchema, missing=TestSchema().load({}))
+    release = fields.Nested(ReleaseSchema, missing=lambda: DEFAULT_SCHEMAS['release'].load({}))
+    test = fields.Nested(TestSchema, missing=lambda: DEFAULT_SCHEMAS['test'].load({}))
     # this field is populated during pre_load
     # this field cannot be written directly in lain.yaml
     procs = fields.Dict(values=fields.Nested(ProcSchema),
                         required=True,
                         error_messages={'required': 'missing proc definition'})
 
+    MISSING_MOUNTPOINT = 'you must define mountpoint for proc {name}, only proc named web will have free mountpoints'
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        self._compiled_loader = None
+        self._validating_loader = None
+        super(LainYamlSchema, self).__init__(*args, **kwargs)
+
+    @property
+    def context(self):
+        return getattr(self._local, 'context', self._context)
+
+    @context.setter
+    def context(self, context):
+        self._context = context
+
+    @property
+    def compiled_loader(self):
+        '''straight-line version of self.load generated from the field
+        declarations, see lain_sdk.yaml.compiled'''
+        if self._compiled_loader is None:
+            try:
+                self._compiled_loader = compile_schema(self)
+            except CompileError:
+                self._compiled_loader = self.load
+        return self._compiled_loader
+
+    def compiled_load(self, data):
+        '''same as self.load, but much faster for valid lain.yaml
+
+        marshmallow stays the reference implementation: whenever the compiled
+        loader rejects data, it is loaded again by marshmallow, so errors are
+        exactly those of self.load. Shared mountpoints are warned about once,
+        whichever loader was used'''
+        try:
+            loaded = self.compiled_loader(data)
+        except Exception:
+            loaded = self.load(data)
+        self.warn_mountpoint_clashes(loaded['procs'])
+        return loaded
+
+    @property
+    def validating_loader(self):
+        '''compiled loader that stops before post_load, None if the schema
+        cannot be compiled'''
+        if self._validating_loader is None:
+            try:
+                self._validating_loader = compile_schema(self, postprocess=False)
+            except CompileError:
+                self._validating_loader = False
+        return self._validating_loader or None
+
+    def validate(self, data, many=None, partial=None):
+        '''errors of data, an empty dict if it is a valid lain.yaml
+
+        runs field validation and the semantic checks of finalize, but none
+        of its other work: no image names, pod names or annotations, so no
+        context is needed. Mountpoints are expanded with the domains of the
+        context, and compared as declared without them. Shared mountpoints
+        are warned about like load does, they are not errors'''
+        loaded, messages = None, {}
+        if self.validating_loader is not None:
+            try:
+                loaded = self.validating_loader(data)
+            except Exception:
+                pass
+        if loaded is None:
+            # marshmallow collects every structural error
+            try:
+                loaded = self._do_load(data, many, partial=partial, postprocess=False)
+            except ValidationError as e:
+                loaded, messages = e.valid_data, e.messages
+            except YAMLError as e:
+                return {'_schema': [f'invalid yaml: {e}']}
+            except Exception as e:
+                return {'_schema': [f'{e.__class__.__name__}: {e}']}
+
+        proc_errors = messages.get('procs')
+        if not isinstance(loaded, dict) or not isinstance(loaded.get('procs'), dict) or \
+                (proc_errors is not None and not isinstance(proc_errors, dict)):
+            return messages
+        # semantic checks only make sense for procs without field errors
+        procs = {name: proc for name, proc in loaded['procs'].items() if name not in (proc_errors or {})}
+        appname = loaded.get('appname')
+        # without domains or a valid appname, declared mountpoints are compared
+        # instead, lain configs are never read
+        domains = None
+        if self.context.get('domains') and isinstance(appname, string_types):
+            domains = self.proc_domains(appname)
+        errors, mountpoints = {}, {}
+        for name, proc in procs.items():
+            mountpoints[name] = {'mountpoint': proc['mountpoint']}
+            if proc['type'] is not ProcType.web:
+                continue
+            try:
+                if domains is not None:
+                    mountpoints[name]['mountpoint'] = self.web_mountpoint(proc, domains)
+                elif name != 'web' and not proc['mountpoint']:
+                    raise ValidationError(self.MISSING_MOUNTPOINT.format(name=name))
+            except ValidationError as e:
+                errors[name] = e.messages
+        self.warn_mountpoint_clashes(mountpoints)
+        if errors:
+            messages = dict(messages, procs=dict(proc_errors or {}, **errors))
+        return messages
+
+    @contextmanager
+    def using_context(self, context):
+        '''set a context only seen by the current thread
+
+        this is what makes a single schema instance (LAIN_YAML_SCHEMA) safe
+        to share, instead of building a new schema for every load'''
+        previous = getattr(self._local, 'context', None)
+        self._local.context = context
+        try:
+            yield self
+        finally:
+            if previous is None:
+                del self._local.context
+            else:
+                self._local.context = previous
+
+    def load_with_context(self, data, context):
+        with self.using_context(context):
+            return self.compiled_load(data)
+
     @staticmethod
     def tell_proc_info(key):
         '''
@@ -317,10 +499,34 @@ class LainYamlSchema(Schema):
             return None, name
         return type_, name
 
+    def proc_clause(self, key, clause):
+        '''name and a copy of clause with name and type filled in, if key is
+        a proc clause, or (None, None)'''
+        type_, name = self.tell_proc_info(key)
+        if not name:
+            return None, None
+        if not isinstance(clause, dict):
+            # left to ProcSchema, which reports it as an invalid proc
+            return name, clause
+        clause = dict(clause)
+        clause['name'] = name
+        if not clause.get('type'):
+            clause['type'] = type_
+
+        if not clause['type']:
+            raise ValidationError(f'cannot infer proc type of {key}:{clause}')
+        return name, clause
+
     @pre_load
     def preprocess(self, data):
         if not isinstance(data, dict):
-            data = yaml.load(data)
+            data = load_yaml(data)
+            if not isinstance(data, dict):
+                raise ValidationError(f'lain.yaml must be a mapping, got {data!r}')
+        else:
+            # never modify the caller's dict, compiled_load may need to
+            # load it a second time
+            data = dict(data)
 
         if 'build' not in data:
             data['build'] = {
@@ -333,18 +539,13 @@ class LainYamlSchema(Schema):
             raise ValidationError('must not write procs in lain.yaml, its generated by program')
         procs = {}
         for key, clause in list(data.items()):
-            type_, name = self.tell_proc_info(key)
+            name, clause = self.proc_clause(key, clause)
             if not name:
                 continue
-            clause['name'] = name
-            if not clause.get('type'):
-                clause['type'] = type_
-
-            if not clause['type']:
-                raise ValidationError(f'cannot infer proc type of {key}:{clause}')
             if name in procs:
                 raise ValidationError(f'duplicate proc name: {name}')
-            procs[name] = data.pop(key)
+            del data[key]
+            procs[name] = clause
 
         data['procs'] = procs
         return data
@@ -357,48 +558,114 @@ class LainYamlSchema(Schema):
         >>> LainYamlSchema.complete_mountpoint(['/foo', 'pornhub.com/bar'], ['baidu.com', 'google.com'], main_entrance=True)
         ['pornhub.com/bar', 'baidu.com/foo', 'google.com/foo', 'baidu.com', 'google.com']
         '''
-        for path in mountpoint[:]:
+        full_urls, paths = [], []
+        for path in mountpoint:
             if path.startswith('/'):
                 # we want full urls, not path
-                full_paths = [f'{domain}{path}' for domain in domains]
-                mountpoint.extend(full_paths)
+                paths.extend(f'{domain}{path}' for domain in domains)
+            else:
+                full_urls.append(path)
 
         if main_entrance:
-            mountpoint.extend(domains)
+            paths.extend(domains)
 
-        return [path for path in mountpoint if not path.startswith('/')]
+        # dict keeps the first occurrence of every url, in order
+        return list(dict.fromkeys(itertools.chain(full_urls, paths)))
+
+    @staticmethod
+    def mountpoint_index(procs, errors=None):
+        '''map every mountpoint to the proc serving it, two procs of the same
+        app must not share a mountpoint. Clashes are collected in errors by
+        proc name if it is given, instead of raised
+
+        >>> LainYamlSchema.mountpoint_index({'web': {'mountpoint': ['a.com', 'a.com/x']}})
+        {'a.com': 'web', 'a.com/x': 'web'}
+        >>> LainYamlSchema.mountpoint_index({'web': {'mountpoint': ['a.com']}, 'admin': {'mountpoint': ['a.com']}})
+        Traceback (most recent call last):
+            ...
+        marshmallow.exceptions.ValidationError: mountpoint a.com of proc admin is already used by proc web
+        '''
+        index = {}
+        for name, proc in procs.items():
+            for path in proc.get('mountpoint') or ():
+                owner = index.setdefault(path, name)
+                if owner != name:
+                    message = f'mountpoint {path} of proc {name} is already used by proc {owner}'
+                    if errors is None:
+                        raise ValidationError(message)
+                    errors.setdefault(name, []).append(message)
+        return index
+
+    @classmethod
+    def warn_mountpoint_clashes(cls, procs):
+        '''warn about mountpoints shared by procs, load and validate accept
+        them like load always did'''
+        clashes = {}
+        cls.mountpoint_index(procs, errors=clashes)
+        for messages in clashes.values():
+            for message in messages:
+                warnings.warn(message, stacklevel=2)
+
+    def proc_domains(self, appname):
+        '''domains of the web procs of appname'''
+        domains = ['%s.%s' % (appname, domain) for domain in self.context.get('domains') or [conf.DOMAIN]]
+        domains.append('%s.lain' % (appname, ))
+        return domains
+
+    def proc_defaults(self, appname):
+        '''default image and domains of the procs of appname'''
+        default_image = gen_image_name(appname, 'release',
+                                       meta_version=self.context['meta_version'],
+                                       registry=self.context['registry'])
+        return default_image, self.proc_domains(appname)
+
+    def web_mountpoint(self, proc, domains):
+        '''mountpoint of a web proc completed with domains'''
+        name, mountpoint = proc['name'], proc['mountpoint']
+        if name == 'web' and not mountpoint:
+            return list(domains)
+        if not mountpoint:
+            raise ValidationError(self.MISSING_MOUNTPOINT.format(name=name))
+        return self.complete_mountpoint(mountpoint, domains, main_entrance=name == 'web')
+
+    def finalize_proc(self, proc, appname, default_image, domains):
+        if not proc['image']:
+            proc['image'] = default_image
+
+        type_ = proc['type']
+        name = proc['name']
+        proc['pod_name'] = f'{appname}.{type_.name}.{name}'
+        if type_ is ProcType.web:
+            proc['mountpoint'] = self.web_mountpoint(proc, domains)
+        return proc
 
     @post_load
     def finalize(self, data):
         appname = data['appname']
-        meta_version = data['meta_version'] = self.context['meta_version']
-        default_image = gen_image_name(appname, 'release',
-                                       meta_version=meta_version,
-                                       registry=self.context['registry'])
+        data['meta_version'] = self.context['meta_version']
+        default_image, domains = self.proc_defaults(appname)
         for proc in itervalues(data['procs']):
-            if not proc['image']:
-                proc['image'] = default_image
-
-            type_ = proc['type']
-            name = proc['name']
-            proc['pod_name'] = f'{appname}.{type_.name}.{name}'
-            if type_ is ProcType.web:
-                is_main = name == 'web'
-                mountpoint = proc['mountpoint']
-                domains = ['%s.%s' % (appname, domain) for domain in self.context.get('domains', [DOMAIN])]
-                domains.append('%s.lain' % (appname, ))
-                if name == 'web' and not mountpoint:
-                    proc['mountpoint'] = domains
-                elif not mountpoint:
-                    raise ValidationError(f'you must define mountpoint for proc {name}, only proc named web will have free mountpoints')
-                else:
-                    proc['mountpoint'] = self.complete_mountpoint(mountpoint, domains, main_entrance=is_main)
-
-            proc['annotation'] = json.dumps(proc, cls=RichEncoder)
+            self.finalize_proc(proc, appname, default_image, domains)
 
         return data
 
 
+# schemas are expensive to build and stateless during load, build them once
+DEFAULT_SCHEMAS = {
+    'prepare': PrepareSchema(),
+    'release': ReleaseSchema(),
+    'test': TestSchema(),
+}
+LAIN_YAML_SCHEMA = LainYamlSchema()
+
+
+def __getattr__(name):
+    # DOMAIN used to be imported from conf, which read lain configs at import time
+    if name == 'DOMAIN':
+        return conf.DOMAIN
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 def get_app_domain(appname):
     try:
         app_domain_list = appname.split('.')
@@ -24,4 +24,5 @@ setup(
     packages=find_packages(exclude=('scripts')),
     include_package_data=True,
     install_requires=requirements,
+    extras_require={'msgpack': ['msgpack>=0.6']},
 )
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import itertools
+import os
+
+import pytest
+
+from lain_sdk import mydocker
+from lain_sdk.buildcache import BuildCache, context_digest
+from lain_sdk.lain_yaml import LainYaml
+
+
+class FakeDocker(object):
+    '''just enough of a docker daemon and a registry for the build cache'''
+
+    def __init__(self, monkeypatch):
+        self.images = {'ubuntu': 'sha256:ubuntu'}
+        self.registry = {}
+        self.builds = []
+        self._ids = itertools.count()
+        for name in ('image_id', 'exist', 'tag', 'pull', 'push', 'build', 'get_tag_list_in_registry'):
+            monkeypatch.setattr(mydocker, name, getattr(self, name))
+
+    def image_id(self, name):
+        if ':prepare-' in name:
+            return 'sha256:prepare'
+        return self.images.get(name)
+
+    def exist(self, name):
+        return self.image_id(name) is not None
+
+    def tag(self, src, dest):
+        self.images[dest] = self.images[src]
+        return 0
+
+    def pull(self, name):
+        self.images[name] = self.registry[name]
+        return 0
+
+    def push(self, name):
+        self.registry[name] = self.images[name]
+        return 0
+
+    def get_tag_list_in_registry(self, registry, appname):
+        prefix = f'{registry}/{appname}:'
+        return [name[len(prefix):] for name in self.registry if name.startswith(prefix)]
+
+    def build(self, name, context, ignore, template, params, build_args, stream=False):
+        self.builds.append(name)
+        self.images[name] = f'sha256:{next(self._ids)}'
+        return name
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    (tmp_path / 'lain.yaml').write_text(open('tests/lain.yaml').read())
+    (tmp_path / 'hello.go').write_text('package main')
+    (tmp_path / '.dockerignore').write_text('docs\n')
+    (tmp_path / 'docs').mkdir()
+    (tmp_path / 'docs/README.md').write_text('hello')
+    commits = itertools.count()
+    monkeypatch.setattr(LainYaml, 'calculate_meta_version', staticmethod(lambda *args: f'{next(commits)}-abc'))
+    return tmp_path
+
+
+def test_context_digest(repo):
+    digest = context_digest(str(repo), ['.git'])
+    (repo / 'docs/README.md').write_text('changed docs')
+    (repo / '.git').mkdir()
+    (repo / '.git/HEAD').write_text('ref: refs/heads/master')
+    assert context_digest(str(repo), ['.git']) == digest
+    os.chmod(repo / 'hello.go', 0o755)
+    assert context_digest(str(repo), ['.git']) != digest
+    (repo / 'hello.go').write_text('package hello')
+    assert context_digest(str(repo)) != digest
+
+
+def test_unchanged_phases_are_tagged(repo, monkeypatch):
+    docker = FakeDocker(monkeypatch)
+    cache = BuildCache('hello')
+
+    def build(mode='multistage'):
+        y = LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True, build_cache=cache)
+        assert y.build_release(use_prepare=True, mode=mode) == (True, y.img_names['release'])
+        return y
+
+    first = build()
+    assert docker.builds == [first.img_names['build'], first.img_names['release']]
+
+    # a doc only commit
+    (repo / 'docs/README.md').write_text('more docs')
+    second = build()
+    assert second.img_names['release'] != first.img_names['release']
+    assert len(docker.builds) == 2
+    assert docker.images[second.img_names['release']] == docker.images[first.img_names['release']]
+
+    # the release of another mode is a different image
+    assert second.phase_fingerprint('release') != second.phase_fingerprint('release', mode='multistage')
+
+    (repo / 'hello.go').write_text('package hello')
+    third = build()
+    assert docker.builds[-2:] == [third.img_names['build'], third.img_names['release']]
+
+
+def test_registry_cache(repo, monkeypatch):
+    docker = FakeDocker(monkeypatch)
+    cache = BuildCache('hello', registry='registry.lain.local')
+    y = LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True, build_cache=cache)
+    assert y.build_base(use_prepare=True)[0]
+    fp = y.phase_fingerprint('build')
+    assert docker.registry == {cache.remote_name(fp): docker.images[y.img_names['build']]}
+
+    # another machine, with an empty docker daemon
+    docker.images = {}
+    other = LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True, build_cache=cache)
+    assert other.build_base(use_prepare=True) == (True, other.img_names['build'])
+    assert len(docker.builds) == 1
+    assert docker.images[other.img_names['build']] == docker.registry[cache.remote_name(fp)]
+
+
+def test_no_cache_without_base_image(repo, monkeypatch):
+    docker = FakeDocker(monkeypatch)
+    y = LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True, build_cache=BuildCache('hello'))
+    assert y.phase_fingerprint('release') is None
+    del docker.images['ubuntu']
+    y.build_base(use_prepare=True)
+    assert y.phase_fingerprint('release') is None
+    assert LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True).phase_fingerprint('build') is None
+
+
+def test_prepare_fingerprint(repo, monkeypatch):
+    docker = FakeDocker(monkeypatch)
+    y = LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True)
+    assert y.input_fingerprint('prepare') is None
+    docker.images['golang'] = 'sha256:golang'
+    fp = y.input_fingerprint('prepare')
+    assert fp is not None
+    assert y.phase_fingerprint('prepare') is None
+    # another commit, with another prepare image name
+    (repo / 'docs/README.md').write_text('more docs')
+    other = LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True)
+    assert other.repo_meta_version != y.repo_meta_version
+    assert other.input_fingerprint('prepare') == fp
+    (repo / 'hello.go').write_text('package hello')
+    assert other.input_fingerprint('prepare') != fp
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import tarfile
+
+from lain_sdk.buildcontext import DockerIgnore, build_context, context_ignore
+
+
+def make_repo(root, files):
+    for path, content in files.items():
+        full_path = root / path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path.write_text(content)
+
+
+def context_names(context, dockerfile='FROM scratch\n', ignore=()):
+    out = io.BytesIO()
+    build_context(context, out, dockerfile, ignore)
+    out.seek(0)
+    with tarfile.open(fileobj=out) as tar:
+        return tar.getnames(), tar.extractfile('Dockerfile').read().decode(), tar.getmembers()
+
+
+def test_dockerignore_patterns():
+    ignore = DockerIgnore(['/node_modules', 'docs/*.md', '!docs/README.md', 'a?c', '[x-z].txt', './tmp/'])
+    assert ignore.excluded('node_modules')
+    assert ignore.excluded('node_modules/left-pad/index.js')
+    assert not ignore.excluded('src/node_modules')
+    assert ignore.excluded('docs/api.md')
+    assert not ignore.excluded('docs/README.md')
+    assert not ignore.excluded('docs/sub/api.md')
+    assert ignore.excluded('abc') and not ignore.excluded('abbc')
+    assert ignore.excluded('y.txt') and not ignore.excluded('a.txt')
+    assert ignore.excluded('tmp/x')
+
+
+def test_build_context(tmp_path):
+    make_repo(tmp_path, {
+        '.dockerignore': '# generated\n*.log\nbuild\n',
+        'main.go': 'package main',
+        'app.log': '',
+        'build/out': '',
+        '.git/HEAD': 'ref: refs/heads/master',
+        'src/lib.go': 'package lib',
+        'Dockerfile': 'FROM the repo',
+    })
+    os.symlink('main.go', tmp_path / 'link.go')
+    before = sorted(os.listdir(tmp_path))
+    names, dockerfile, members = context_names(str(tmp_path), 'FROM golang\n', ignore=['.git'])
+    assert names == ['Dockerfile', 'src', '.dockerignore', 'link.go', 'main.go', 'src/lib.go']
+    assert dockerfile == 'FROM golang\n'
+    assert all(member.uid == 0 and member.uname == '' for member in members)
+    assert members[names.index('link.go')].issym()
+    # the working tree is left alone
+    assert sorted(os.listdir(tmp_path)) == before
+    assert (tmp_path / '.dockerignore').read_text() == '# generated\n*.log\nbuild\n'
+
+
+def test_gitignore_fallback(tmp_path):
+    make_repo(tmp_path, {'.gitignore': 'vendor\n', 'vendor/x.go': '', 'main.go': ''})
+    assert context_ignore(str(tmp_path), ['.git']) == ['vendor', '.git']
+    assert context_names(str(tmp_path))[0] == ['Dockerfile', '.gitignore', 'main.go']
+    assert context_names(None)[0] == ['Dockerfile']
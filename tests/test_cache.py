@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import pickle
+import shutil
+import subprocess
+
+import pytest
+from marshmallow import ValidationError
+
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.yaml import cache as cache_module
+from lain_sdk.yaml.cache import ManifestCache, ParseCache
+from lain_sdk.yaml.parser import LAIN_YAML_SCHEMA, ProcType
+
+YAML = open('tests/lain.yaml').read()
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def test_hit_and_miss():
+    cache = ParseCache()
+    first = LainYaml(data=YAML, meta_version=META_VERSION, cache=cache)
+    second = LainYaml(data=YAML, meta_version=META_VERSION, cache=cache)
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 1
+    assert first.procs['web'].annotation == second.procs['web'].annotation
+
+
+def test_context_is_part_of_key():
+    cache = ParseCache()
+    LainYaml(data=YAML, meta_version=META_VERSION, cache=cache)
+    y = LainYaml(data=YAML, meta_version='123-abc', cache=cache)
+    assert cache.misses == 2
+    assert y.meta_version == '123-abc'
+
+
+def test_hits_are_isolated():
+    cache = ParseCache()
+    y = LainYaml(data=YAML, meta_version=META_VERSION, cache=cache)
+    y.procs['web'].env.append('POLLUTED=1')
+    y.procs['web'].image = 'whatever'
+    y = LainYaml(data=YAML, meta_version=META_VERSION, cache=cache)
+    assert 'POLLUTED=1' not in y.procs['web'].env
+    assert y.procs['web'].image != 'whatever'
+
+
+def test_eviction():
+    cache = ParseCache(max_entries=2)
+    for meta_version in ('1-a', '2-b', '3-c'):
+        LainYaml(data=YAML, meta_version=meta_version, cache=cache)
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    # least recently used entry is gone
+    LainYaml(data=YAML, meta_version='1-a', cache=cache)
+    assert cache.misses == 4
+
+    cache = ParseCache(max_bytes=1)
+    LainYaml(data=YAML, meta_version=META_VERSION, cache=cache)
+    assert len(cache) == 0
+    assert cache.bytes == 0
+
+
+def test_errors_are_not_cached():
+    cache = ParseCache()
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            LainYaml(data='appname: service\nweb: {}\n', meta_version=META_VERSION, cache=cache)
+    assert cache.misses == 2
+    assert len(cache) == 0
+
+
+CONTEXT = {'meta_version': META_VERSION, 'domains': ['lain.local'], 'registry': 'registry.lain.local'}
+
+
+@pytest.fixture
+def lain_yaml_path(tmpdir):
+    path = str(tmpdir.join('lain.yaml'))
+    shutil.copy('tests/lain.yaml', path)
+    # old enough for mtime and size to be trusted
+    os.utime(path, (1, 1))
+    return path
+
+
+def counting_loader(calls):
+    def loader(raw, context):
+        calls.append(context)
+        return LAIN_YAML_SCHEMA.load_with_context(raw, context)
+    return loader
+
+
+def test_manifest_cache(lain_yaml_path):
+    calls = []
+    manifest_cache = ManifestCache(lain_yaml_path)
+    raw, loaded = manifest_cache.get_or_load(CONTEXT, counting_loader(calls))
+    assert manifest_cache.hit is False
+    assert os.path.exists(manifest_cache.path)
+    assert manifest_cache.path.endswith(os.path.join('.lain', 'cache', 'lain.yaml.json'))
+
+    manifest_cache = ManifestCache(lain_yaml_path)
+    cached_raw, cached = manifest_cache.get_or_load(CONTEXT, counting_loader(calls))
+    assert manifest_cache.hit is True
+    assert (cached_raw, cached) == (raw, loaded)
+    assert len(calls) == 1
+
+    # context is part of the key
+    manifest_cache.get_or_load(dict(CONTEXT, registry='other'), counting_loader(calls))
+    assert manifest_cache.hit is False
+
+    # same size, new mtime: hashed, content changed
+    with open(lain_yaml_path, 'w') as f:
+        f.write(raw.replace('appname: hello', 'appname: jello'))
+    _, loaded = manifest_cache.get_or_load(CONTEXT, counting_loader(calls))
+    assert manifest_cache.hit is False
+    assert loaded['appname'] == 'jello'
+    assert len(calls) == 3
+
+
+def test_manifest_cache_ignores_broken_entries(lain_yaml_path):
+    manifest_cache = ManifestCache(lain_yaml_path)
+    os.makedirs(os.path.dirname(manifest_cache.path))
+    with open(manifest_cache.path, 'wb') as f:
+        f.write(b'garbage')
+    _, loaded = manifest_cache.get_or_load(CONTEXT, counting_loader([]))
+    assert loaded['appname'] == 'hello'
+    assert manifest_cache.read()['loaded'] == loaded
+
+
+def test_manifest_cache_is_not_executable(lain_yaml_path):
+    manifest_cache = ManifestCache(lain_yaml_path)
+    _, loaded = manifest_cache.get_or_load(CONTEXT, counting_loader([]))
+    with open(manifest_cache.path) as f:
+        entry = json.load(f)
+    assert entry['loaded']['procs']['web']['type'] == 'web'
+
+    manifest_cache = ManifestCache(lain_yaml_path)
+    _, cached = manifest_cache.get_or_load(CONTEXT, counting_loader([]))
+    assert manifest_cache.hit is True
+    assert cached == loaded
+    assert cached['procs']['web']['type'] is ProcType.web
+    assert cached['procs']['web']['annotation'] == loaded['procs']['web']['annotation']
+
+    # a pickle planted in the checkout is just a broken entry
+    with open(manifest_cache.path, 'wb') as f:
+        f.write(pickle.dumps(os.getcwd))
+    manifest_cache.get_or_load(CONTEXT, counting_loader([]))
+    assert manifest_cache.hit is False
+
+
+def test_disk_cache_excludes_cache(lain_yaml_path):
+    with pytest.raises(ValueError):
+        LainYaml(lain_yaml_path=lain_yaml_path, meta_version=META_VERSION, disk_cache=True, cache=ParseCache())
+
+
+def test_warm_run_skips_git(lain_yaml_path, monkeypatch):
+    repo = os.path.dirname(lain_yaml_path)
+    git = ['git', '-c', 'user.name=lain', '-c', 'user.email=lain@example.com']
+    subprocess.check_call(git + ['init', '-q', repo])
+    subprocess.check_call(git + ['-C', repo, 'add', 'lain.yaml'])
+    subprocess.check_call(git + ['-C', repo, 'commit', '-qm', 'init'])
+    cold = LainYaml(lain_yaml_path=lain_yaml_path, ignore_prepare=True, disk_cache=True)
+    assert cold.meta_version
+
+    def no_git(*args, **kwargs):
+        raise AssertionError('git should not run')
+
+    monkeypatch.setattr(cache_module, 'meta_version', no_git)
+    monkeypatch.setattr(LainYaml, 'calculate_meta_version', staticmethod(no_git))
+    monkeypatch.setattr(LAIN_YAML_SCHEMA, 'load_with_context', no_git)
+    warm = LainYaml(lain_yaml_path=lain_yaml_path, ignore_prepare=True, disk_cache=True)
+    assert warm.meta_version == cold.meta_version
+    assert warm.procs['web'].annotation == cold.procs['web'].annotation
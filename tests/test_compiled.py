@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import glob
+import warnings
+
+import pytest
+from marshmallow import ValidationError
+
+from lain_sdk.yaml.compiled import CompileError, compile_schema
+from lain_sdk.yaml.parser import LainYamlSchema, ProcSchema
+
+CONTEXT = {'meta_version': '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc',
+           'domains': ['extra.domain1.com', 'lain.local'],
+           'registry': 'registry.lain.local'}
+DOCUMENTS = [open(f).read() for f in sorted(glob.glob('fixtures/data/*.yaml')) + ['tests/lain.yaml']]
+INVALID_DOCUMENTS = [
+    'appname: service\nweb: {}\n',
+    'appname: hello\nprocs: {}\n',
+    'appname: hello\nworker: {num_instances: many}\n',
+    'appname: hello\nworker: {type: cron}\n',
+    'appname: hello\nproc.foo: {type: upper}\n',
+    'appname: hello\nworker: {env: [NOT AN ENV]}\n',
+    'appname: hello\nworker: {volumes: [/lain]}\n',
+    'appname: hello\nworker: {logs: [/abs.log]}\n',
+    'appname: hello\nworker: {port: "80:tcp:foo"}\n',
+    'appname: hello\nworker: {whatever: 1}\n',
+    'appname: hello\nweb.foo: {cmd: foo}\n',
+    'appname: hello\nbuild: {script: [make]}\nweb: {}\n',
+    'appname: hello\nrelease: {copy: [1]}\nweb: {}\n',
+]
+
+
+def big_document(n):
+    doc = {'appname': 'big', 'build': {'base': 'golang', 'script': ['make']}}
+    for i in range(n):
+        doc[f'worker.w{i}'] = {'cmd': 'run', 'memory': '128m', 'env': ['A=1'], 'volumes': ['/data'],
+                               'port': '8080:tcp', 'setup_time': '10s', 'persistent_dirs': ['/var/x']}
+        doc[f'web.p{i}'] = {'cmd': 'serve', 'mountpoint': [f'/p{i}', f'p{i}.com/x'], 'port': 80,
+                            'secret_files': ['a', '/b'], 'shared_volumes': {'global': ['/a:/b']}}
+        doc[f'cron.c{i}'] = {'cmd': ['run', 'job'], 'schedule': '* * * * *', 'num_instances': '2'}
+    return doc
+
+
+@pytest.mark.parametrize('document', DOCUMENTS + [big_document(5)])
+def test_same_output_as_marshmallow(document):
+    schema = LainYamlSchema(context=CONTEXT)
+    expected = schema.load(document)
+    loaded = compile_schema(schema)(document)
+    assert loaded == expected
+    for name, proc in expected['procs'].items():
+        assert list(loaded['procs'][name]) == list(proc)
+        assert loaded['procs'][name]['annotation'] == proc['annotation']
+
+
+@pytest.mark.parametrize('document', INVALID_DOCUMENTS)
+def test_same_errors_as_marshmallow(document):
+    schema = LainYamlSchema(context=CONTEXT)
+    with pytest.raises(ValidationError) as expected:
+        schema.load(document)
+    with pytest.raises(ValidationError):
+        schema.compiled_loader(document)
+    with pytest.raises(ValidationError) as e:
+        schema.compiled_load(document)
+    assert e.value.messages == expected.value.messages
+
+
+def test_dict_input_is_not_modified():
+    document = big_document(1)
+    keys = set(document)
+    LainYamlSchema(context=CONTEXT).compiled_load(document)
+    assert set(document) == keys
+    assert 'name' not in document['worker.w0']
+
+
+def test_clashes_are_warned_once():
+    schema = LainYamlSchema(context=CONTEXT)
+    compiled = schema.compiled_loader
+
+    def fails_after_loading(data):
+        compiled(data)
+        raise RuntimeError('falls back to marshmallow')
+
+    schema._compiled_loader = fails_after_loading
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        schema.compiled_load('appname: a\nweb: {mountpoint: [/x]}\nweb.admin: {mountpoint: [a.lain/x]}\n')
+    assert [str(w.message) for w in caught] == ['mountpoint a.lain/x of proc admin is already used by proc web']
+
+
+def test_unsupported_schema():
+    class Unsupported(ProcSchema):
+        class Meta:
+            unknown = 'include'
+
+    with pytest.raises(CompileError):
+        compile_schema(Unsupported())
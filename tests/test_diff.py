@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.yaml.diff import diff
+
+OLD = '''
+appname: hello
+web:
+  cmd: serve
+  memory: 64m
+worker.queue:
+  cmd: consume
+worker.custom:
+  image: hello/custom:1
+cron.clean:
+  cmd: clean
+  schedule: '* * * * *'
+'''
+
+
+def load(raw, meta_version):
+    return LainYaml(data=raw, meta_version=meta_version, domains=['lain.local'], registry='registry.lain.local')
+
+
+def test_new_release_alone_changes_nothing():
+    result = diff(load(OLD, '1-aaa'), load(OLD, '2-bbb'))
+    assert result.added == result.removed == []
+    assert result.changed == {}
+    assert result.unchanged == ['clean', 'custom', 'queue', 'web']
+
+
+def test_changed_fields():
+    new = OLD.replace('64m', '128m').replace('custom:1', 'custom:2').replace('cron.clean', 'cron.purge')
+    new += 'worker.extra:\n  cmd: extra\n'
+    result = diff(load(OLD, '1-aaa'), load(new, '2-bbb').loaded)
+    assert result.added == ['extra', 'purge']
+    assert result.removed == ['clean']
+    assert result.changed == {'custom': ['image'], 'web': ['memory']}
+    assert result.unchanged == ['queue']
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.yaml.export import PROC_FIELDS, deploy_spec, to_json, to_msgpack, write_ndjson
+
+YAML = open('tests/lain.yaml').read()
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def test_deploy_spec():
+    y = LainYaml(data=YAML, meta_version=META_VERSION)
+    spec = deploy_spec(y)
+    assert spec['appname'] == 'hello'
+    assert spec['meta_version'] == META_VERSION
+    assert [proc['name'] for proc in spec['procs']] == sorted(y.procs)
+    web = next(proc for proc in spec['procs'] if proc['name'] == 'web')
+    assert tuple(web) == PROC_FIELDS
+    assert web['type'] == 'web'
+    assert web['port'] == [{'port': 80, 'type': 'tcp'}]
+    assert web['pod_name'] == y.procs['web'].pod_name
+    assert json.loads(to_json(y)) == spec
+    assert to_json(y) == to_json(y.loaded)
+
+
+def test_msgpack():
+    msgpack = pytest.importorskip('msgpack')
+    y = LainYaml(data=YAML, meta_version=META_VERSION)
+    assert msgpack.unpackb(to_msgpack(y), raw=False) == deploy_spec(y)
+    assert len(to_msgpack(y)) < len(to_json(y))
+
+
+def test_ndjson():
+    apps = [LainYaml(data=YAML, meta_version=f'{i}-abc') for i in range(3)]
+    stream = io.StringIO()
+    assert write_ndjson(apps, stream) == 3
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)['meta_version'] for line in lines] == ['0-abc', '1-abc', '2-abc']
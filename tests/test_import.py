@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ('docker', 'requests', 'jinja2', 'multiprocessing')
+# self time of lain_sdk modules, dependencies like marshmallow are not counted
+IMPORT_BUDGET_US = 150000
+
+CHECK = '''
+import sys
+import {module}
+from lain_sdk.yaml import conf
+assert conf.get_etc.cache_info().currsize == 0, 'lain configs were read at import time'
+print(','.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+@pytest.mark.parametrize('module', ['lain_sdk.yaml.parser', 'lain_sdk.lain_yaml'])
+def test_import_time(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHECK.format(module=module, heavy=HEAVY_MODULES)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    assert result.stdout.strip() == ''
+    self_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        if name.strip().startswith('lain_sdk'):
+            self_us += int(self_time)
+    assert self_us < IMPORT_BUDGET_US
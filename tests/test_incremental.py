@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import pytest
+from marshmallow import ValidationError
+
+from lain_sdk.yaml.incremental import IncrementalLoader
+from lain_sdk.yaml.parser import LAIN_YAML_SCHEMA
+
+CONTEXT = {'meta_version': '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc',
+           'domains': ['lain.local'],
+           'registry': 'registry.lain.local'}
+
+
+def document(n=20):
+    doc = {'appname': 'hello', 'build': {'base': 'golang', 'script': ['make']},
+           'release': {'copy': [{'src': 'hello'}]}}
+    for i in range(n):
+        doc[f'worker.w{i}'] = {'cmd': 'run', 'memory': '64m'}
+    doc['web'] = {'cmd': 'serve'}
+    doc['web.foo'] = {'cmd': 'serve', 'mountpoint': ['/foo']}
+    return doc
+
+
+def full_load(doc):
+    return LAIN_YAML_SCHEMA.load_with_context(doc, CONTEXT)
+
+
+def test_only_changed_clauses_are_loaded():
+    loader = IncrementalLoader(CONTEXT)
+    doc = document()
+    first = loader.load(doc)
+    doc['web.foo']['mountpoint'] = ['/bar']
+    doc['build']['script'] = ['make', 'make install']
+    doc['worker.extra'] = {'cmd': 'extra'}
+    del doc['worker.w3']
+    loaded = loader.load(doc)
+    assert loader.reloaded == {'web.foo', 'build', 'worker.extra', 'worker.w3'}
+    assert loaded == full_load(doc)
+    assert list(loaded['procs']) == list(full_load(doc)['procs'])
+    assert loaded['procs']['w0'] is first['procs']['w0']
+    assert loaded['procs']['foo']['annotation'] == full_load(doc)['procs']['foo']['annotation']
+
+
+def test_full_load_when_appname_changes():
+    loader = IncrementalLoader(CONTEXT)
+    doc = document(2)
+    loader.load(doc)
+    doc['appname'] = 'world'
+    assert loader.load(doc) == full_load(doc)
+    assert loader.reloaded == set(doc)
+
+
+def test_errors_are_those_of_a_full_load():
+    loader = IncrementalLoader(CONTEXT)
+    doc = document(2)
+    loader.load(doc)
+    doc['web.w1'] = {'cmd': 'serve', 'mountpoint': ['/w1']}
+    with pytest.raises(ValidationError) as e:
+        loader.load(doc)
+    assert e.value.messages == {'_schema': ['duplicate proc name: w1']}
+
+    del doc['web.w1']
+    doc['worker.w0'] = {'num_instances': 'many'}
+    with pytest.raises(ValidationError):
+        loader.load(doc)
+
+
+def test_shared_mountpoints_are_accepted():
+    loader = IncrementalLoader(CONTEXT)
+    doc = document(2)
+    loader.load(doc)
+    doc['web.foo']['mountpoint'] = ['hello.lain.local']
+    with pytest.warns(UserWarning, match='mountpoint hello.lain.local of proc foo is already used by proc web'):
+        loaded = loader.load(doc)
+    assert loader.reloaded == {'web.foo'}
+    assert loaded['procs']['foo']['mountpoint'] == ['hello.lain.local']
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import json
+import pstats
+
+import pytest
+
+from lain_sdk import instrument, mydocker
+from lain_sdk.instrument import Timeline, span, traced
+from lain_sdk.lain_yaml import LainYaml
+
+
+def test_nested_spans():
+    with Timeline() as timeline:
+        with span('outer', app='hello') as outer:
+            with span('inner'):
+                pass
+            outer.attributes['result'] = 'ok'
+    inner, outer = sorted(timeline.spans, key=lambda s: s.name)
+    assert inner.parent == outer.id
+    assert outer.parent is None
+    assert outer.attributes == {'app': 'hello', 'result': 'ok'}
+    assert 0 <= inner.duration <= outer.duration
+    assert [s['name'] for s in timeline.to_dict()['spans']] == ['outer', 'inner']
+    assert instrument.current_span() is None
+
+
+def test_error_recorded():
+    @traced('fail')
+    def fail():
+        raise ValueError('boom')
+
+    with Timeline() as timeline:
+        with pytest.raises(ValueError):
+            fail()
+    assert timeline.spans[0].attributes['error'] == "ValueError('boom')"
+
+
+def test_profile_and_timeline(tmp_path, monkeypatch):
+    monkeypatch.setenv(instrument.PROFILE_ENV, str(tmp_path))
+
+    @traced('phase', profile=True)
+    def phase():
+        with span('nested', profile=True):
+            sum(range(1000))
+
+    with Timeline() as timeline:
+        phase()
+    path = tmp_path / 'timeline.json'
+    timeline.write(str(path))
+    spans = json.loads(path.read_text())['spans']
+    assert [s['name'] for s in spans] == ['phase', 'nested']
+    # only the outermost phase is profiled
+    assert 'profile' not in spans[1]['attributes']
+    pstats.Stats(spans[0]['attributes']['profile'])
+
+
+def test_build_spans(monkeypatch):
+    monkeypatch.setattr(mydocker.subprocess, 'call', lambda cmd, **kwargs: 0)
+    y = LainYaml(lain_yaml_path='tests/lain.yaml', ignore_prepare=True)
+    with Timeline() as timeline:
+        assert y.build_meta() == (True, y.img_names['meta'])
+        mydocker._docker(['login', '-u', 'user', '-p', 'secret', 'registry.lain.local'])
+    build_meta, docker_build = timeline.spans[1], timeline.spans[0]
+    assert build_meta.name == 'build_meta'
+    assert docker_build.name == 'docker.build'
+    assert docker_build.parent == build_meta.id
+    assert docker_build.attributes['retcode'] == 0
+    assert 'secret' not in json.dumps(timeline.to_dict())
+
+
+def test_build_args_are_redacted(monkeypatch):
+    monkeypatch.setattr(mydocker.subprocess, 'call', lambda cmd, **kwargs: 0)
+    monkeypatch.setenv('NPM_TOKEN', 'npm-secret')
+    with Timeline() as timeline:
+        mydocker.build_image('hello:build', '.', ['NPM_TOKEN=$NPM_TOKEN', 'PLAIN=plain-secret'])
+        mydocker._docker(['login', '--password=login-secret', 'registry.lain.local'])
+    dumped = json.dumps(timeline.to_dict())
+    for secret in ('npm-secret', 'plain-secret', 'login-secret'):
+        assert secret not in dumped
+    assert timeline.spans[0].attributes['args'][3:7] == ['--build-arg', 'NPM_TOKEN=***', '--build-arg', 'PLAIN=***']
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import glob
+
+import pytest
+import yaml
+
+from lain_sdk.yaml.io import LIBYAML, dump_yaml, load_yaml
+
+
+@pytest.mark.skipif(not LIBYAML, reason='PyYAML is built without libyaml')
+def test_libyaml_parses_like_pure_python():
+    for fixture in [open(f).read() for f in sorted(glob.glob('fixtures/data/*.yaml'))]:
+        assert load_yaml(fixture) == yaml.load(fixture, Loader=yaml.SafeLoader)
+
+
+def test_round_trip():
+    for fixture in [open(f).read() for f in sorted(glob.glob('fixtures/data/*.yaml'))]:
+        data = load_yaml(fixture)
+        assert load_yaml(dump_yaml(data)) == data
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
-from lain_sdk.lain_yaml import LainYaml
+from marshmallow import ValidationError
+
+from lain_sdk.lain_yaml import LainYaml, iter_lain_yamls, parse_many
 
 YAML = 'tests/lain.yaml'
 
@@ -35,3 +37,125 @@ def test_prepare_act():
     assert len(y.release.copy) == 1
     assert y.release.copy[0]['src'] == 'hello'
     assert y.release.copy[0]['dest'] == '/usr/bin/hello'
+
+
+def test_validate_accepts_what_load_accepts():
+    document = {'appname': 'big'}
+    for i in range(100):
+        document[f'web.p{i}'] = {'cmd': 'serve', 'mountpoint': [f'/p{i}', f'p{i}.com/x'], 'port': 80}
+    app = LainYaml(data=document, meta_version='1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc',
+                   domains=['lain.local'], registry='registry.lain.local')
+    assert len(app.procs) == 100
+    assert LainYaml.validate(document) == {}
+
+
+def test_parse_many():
+    sources = [open(YAML).read(), 'appname: service\nweb: {}\n', 'appname: [', {'appname': 'dict', 'worker': {'cmd': 'run'}}]
+    results = parse_many(sources * 3, context={'meta_version': '1-a'}, workers=2, chunksize=2)
+    assert len(results) == 12
+    for i in range(0, 12, 4):
+        assert results[i].error is None
+        assert results[i].lain_yaml.appname == 'hello'
+        assert results[i].lain_yaml.meta_version == '1-a'
+        assert results[i + 1].lain_yaml is None
+        assert 'appname' in results[i + 1].error.messages
+        assert isinstance(results[i + 2].error, ValidationError)
+        assert tuple(results[i + 3].lain_yaml.procs['worker'].cmd) == ('run', )
+    serial = parse_many(sources, context={'meta_version': '1-a'}, workers=1)
+    assert [r.error is None for r in serial] == [True, False, False, True]
+
+
+def test_iter_lain_yamls():
+    stream = [
+        '# a corpus of manifests\n',
+        '%YAML 1.1\n',
+        '---\n',
+        'appname: first\n',
+        'worker: {cmd: run}\n',
+        '--- \n',
+        'appname: service\n',
+        'web: {}\n',
+        '---\n',
+        'appname: [\n',
+        '...\n',
+        '# nothing in here\n',
+        '---\n',
+        'appname: last\n',
+        'web:\n',
+        '  cmd: |\n',
+        '    serve --- forever\n',
+    ]
+    lines = iter(stream)
+    results = iter_lain_yamls(lines, context={'meta_version': '1-a'})
+    first = next(results)
+    # the stream is consumed one document at a time
+    assert next(lines) == 'appname: service\n'
+    assert first.lain_yaml.appname == 'first'
+    assert first.lain_yaml.meta_version == '1-a'
+
+    results = list(iter_lain_yamls(''.join(stream)))
+    assert len(results) == 4
+    assert [r.error is None for r in results] == [True, False, False, True]
+    assert 'appname' in results[1].error.messages
+    assert tuple(results[3].lain_yaml.procs['web'].cmd) == ('serve', '---', 'forever')
+
+
+def test_iter_lain_yamls_content_on_marker_line():
+    stream = '--- {appname: a, worker: {cmd: x}}\n--- # b\n{appname: b, worker: {cmd: y}}\n--- \n...\n'
+    results = list(iter_lain_yamls(stream, context={'meta_version': '1-a'}))
+    assert [r.lain_yaml.appname for r in results] == ['a', 'b']
+    assert tuple(results[1].lain_yaml.procs['worker'].cmd) == ('y', )
+
+
+def test_iter_lain_yamls_empty_documents():
+    context = {'meta_version': '1-a'}
+    stream = '---\n---\n# a\nappname: a\nworker: {cmd: x}\n'
+    assert [r.lain_yaml.appname for r in iter_lain_yamls(stream, context=context)] == ['a']
+    stream = 'appname: a\nworker: {cmd: x}\n---\n--- \n---\nappname: b\nworker: {cmd: y}\n'
+    results = list(iter_lain_yamls(stream, context=context))
+    assert [r.error for r in results] == [None, None]
+    assert [r.lain_yaml.appname for r in results] == ['a', 'b']
+
+
+def test_iter_lain_yamls_ndjson():
+    stream = '{"appname": "first", "worker": {"cmd": "run"}}\n\n{"appname": \n{"appname": "last"}\n'
+    results = list(iter_lain_yamls(stream, format='ndjson'))
+    assert [r.error is None for r in results] == [True, False, True]
+    assert results[0].lain_yaml.appname == 'first'
+    assert results[1].error.messages[0].startswith('JSONDecodeError')
+
+
+def test_render_dockerfiles():
+    y = LainYaml(lain_yaml_path=YAML, ignore_prepare=True)
+    dockerfiles = y.render_dockerfiles()
+    assert set(dockerfiles) == set(y.img_names)
+    assert dockerfiles['prepare'].startswith('FROM golang\n')
+    assert 'RUN (go build -o hello)' in dockerfiles['build']
+    assert dockerfiles['test'].startswith(f"FROM {y.img_names['build']}\n")
+    assert 'COPY lain.yaml /lain.yaml' in dockerfiles['meta']
+    # templates are compiled once and shared between LainYaml objects
+    assert LainYaml(lain_yaml_path=YAML, ignore_prepare=True).img_temps['build'] is y.img_temps['build']
+
+
+def test_multistage_release(monkeypatch):
+    from lain_sdk import mydocker
+
+    commands, dockerfiles = [], []
+
+    def fake_call(cmd, **kwargs):
+        commands.append(cmd[1])
+        if cmd[1] == 'build':
+            dockerfiles.append(open(cmd[cmd.index('-f') + 1]).read())
+        return 0
+
+    monkeypatch.setattr(mydocker.subprocess, 'call', fake_call)
+    y = LainYaml(lain_yaml_path='fixtures/data/release.yaml', ignore_prepare=True)
+    assert y.build_release(use_build=True, mode='multistage') == (True, y.img_names['release'])
+    # no intermediate images, no container to copy release files out of
+    assert commands == ['build']
+    dockerfile = dockerfiles[0]
+    assert dockerfile.startswith(f"FROM {y.img_names['build']} AS build\n")
+    assert "RUN (echo 'release')" in dockerfile
+    assert 'FROM ubuntu\n' in dockerfile
+    assert 'COPY --from=build /lain/app/hello /usr/bin/hello\n' in dockerfile
+    assert 'COPY --from=build /lain/app/hi /lain/app/hi\n' in dockerfile
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import gc
+import json
+import tracemalloc
+
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.yaml.models import App, Port, Proc
+from lain_sdk.yaml.parser import LAIN_YAML_SCHEMA, SocketType
+
+YAML = open('tests/lain.yaml').read()
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def test_same_attributes_as_box():
+    box = LainYaml(data=YAML, meta_version=META_VERSION)
+    models = LainYaml(data=YAML, meta_version=META_VERSION, models=True)
+    assert isinstance(models.app, App)
+    assert models.appname == box.appname
+    assert models.meta_version == box.meta_version
+    assert models.build.base == box.build.base
+    assert models.build.prepare.script == box.build.prepare.script
+    assert models.release.copy[0]['dest'] == box.release.copy[0]['dest']
+    assert models.test.script == box.test.script
+    assert set(models.procs) == set(box.procs)
+    for name, proc in models.procs.items():
+        assert isinstance(proc, Proc)
+        for field in proc.fields():
+            if field != 'port':
+                assert getattr(proc, field) == getattr(box.procs[name], field)
+        assert json.loads(proc.annotation) == json.loads(box.procs[name].annotation)
+    assert models.procs['web'].port[80] == Port(type=SocketType.tcp, port=80)
+
+
+def test_same_annotation_as_box():
+    data = 'appname: hello\nworker.nocmd: {memory: 64m}\nweb: {cmd: serve, port: 8080}\n'
+    box = LainYaml(data=data, meta_version=META_VERSION)
+    models = LainYaml(data=data, meta_version=META_VERSION, models=True)
+    for name, proc in models.procs.items():
+        assert proc.annotation == box.procs[name].annotation
+    assert 'cmd' not in json.loads(models.procs['nocmd'].annotation)
+
+
+def test_annotation_of_the_fields():
+    models = LainYaml(data=YAML, meta_version=META_VERSION, models=True)
+    proc = models.procs['web']
+    # the annotation is made from the fields, the loaded proc is not kept
+    assert models.loaded['procs']['web'] not in gc.get_referents(proc)
+    proc.memory = 1
+    assert json.loads(proc.annotation)['memory'] == 1
+
+
+def test_slots():
+    proc = LainYaml(data=YAML, meta_version=META_VERSION, models=True).procs['web']
+    assert not hasattr(proc, '__dict__')
+
+
+def test_smaller_than_box():
+    context = {'meta_version': META_VERSION, 'domains': ['lain.local'], 'registry': 'registry.lain.local'}
+    loaded = LAIN_YAML_SCHEMA.load_with_context(YAML, context)
+
+    def allocated(models):
+        tracemalloc.start()
+        y = LainYaml.from_loaded(loaded, models=models)
+        # touch every proc, Box converts nested dicts on access
+        for proc in y.procs.values():
+            proc.port, proc.env
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size, y
+
+    box_size, box = allocated(False)
+    models_size, models = allocated(True)
+
+    def read(y):
+        return [y.procs[name].env for name in y.procs] + [y.build.prepare.version, y.release.dest_base]
+
+    assert models_size < box_size
+    assert read(models) == read(box)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import collections
+import os
+import threading
+import time
+
+from lain_sdk import monorepo, mydocker
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.monorepo import MonorepoBuilder, discover
+
+LAIN_YAML = '''appname: {appname}
+build:
+  base: golang
+  script: [go build]
+release:
+  dest_base: {dest_base}
+  copy: [{appname}]
+web:
+  cmd: {appname}
+'''
+
+
+def make_monorepo(root, apps):
+    for path, (appname, dest_base) in apps.items():
+        (root / path).mkdir(parents=True)
+        (root / path / 'lain.yaml').write_text(LAIN_YAML.format(appname=appname, dest_base=dest_base))
+    (root / 'node_modules/dep').mkdir(parents=True)
+    (root / 'node_modules/dep/lain.yaml').write_text('not an app')
+
+
+def test_discover(tmp_path):
+    make_monorepo(tmp_path, {'b': ('b', 'ubuntu'), 'a/web': ('a', 'ubuntu')})
+    assert discover(str(tmp_path)) == [str(tmp_path / 'a/web/lain.yaml'), str(tmp_path / 'b/lain.yaml')]
+
+
+def test_build_all(tmp_path, monkeypatch):
+    make_monorepo(tmp_path, {
+        'hello': ('hello', 'ubuntu'),
+        'hello-canary': ('hello', 'ubuntu'),
+        'world': ('world', 'alpine'),
+        'broken': ('broken', 'ubuntu'),
+    })
+    calls = collections.Counter()
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            calls[key] += 1
+
+    def build_prepare(self):
+        count(('prepare', self.img_names['prepare']))
+        time.sleep(0.05)
+        return (True, self.img_names['prepare'])
+
+    def build_release(self, use_prepare=False, use_build=False, mode='legacy'):
+        time.sleep(0.1)
+        if self.appname == 'broken':
+            return (False, None)
+        return (True, self.img_names['release'])
+
+    # prepare image names differ between apps, like timestamped ones do
+    monkeypatch.setattr(LainYaml, 'ensure_proper_shared_image', lambda self: None)
+    monkeypatch.setattr(LainYaml, 'gen_prepare_shared_image_name',
+                        lambda self: f'{self.appname}:prepare-{os.path.basename(self.ctx)}')
+    monkeypatch.setattr(LainYaml, 'build_prepare', build_prepare)
+    monkeypatch.setattr(LainYaml, 'build_release', build_release)
+    monkeypatch.setattr(mydocker, 'exist', lambda name: False)
+    monkeypatch.setattr(mydocker, 'image_id', lambda name: f'sha256:{name}')
+    monkeypatch.setattr(mydocker, 'pull', lambda name: count(('pull', name)) or 0)
+    monkeypatch.setattr(mydocker, 'tag', lambda src, dest: count(('tag', src, dest)) or 0)
+    monkeypatch.setattr(mydocker, 'push', lambda name: count(('push', name)) or 0)
+
+    summary = MonorepoBuilder(str(tmp_path), max_workers=4).run()
+    assert [(r.appname, r.ok) for r in summary.results] == [
+        ('broken', False), ('hello', True), ('hello', True), ('world', True)]
+    assert summary.results[0].error == 'release failed'
+    # every base image is pulled once, prepare images with the same inputs are built once,
+    # world and broken have the same prepare section but not the same context
+    hello = [key for key in calls if key[0] == 'prepare' and key[1].startswith('hello:')]
+    assert len(hello) == 1
+    built, tagged = hello[0][1], ({'hello:prepare-hello', 'hello:prepare-hello-canary'} - {hello[0][1]}).pop()
+    assert calls == {('pull', 'golang'): 1, ('pull', 'ubuntu'): 1, ('pull', 'alpine'): 1,
+                     ('prepare', built): 1, ('tag', built, tagged): 1, ('push', tagged): 1,
+                     ('prepare', 'world:prepare-world'): 1, ('prepare', 'broken:prepare-broken'): 1}
+    assert not summary.ok
+    assert summary.wall_time < summary.serial_time
+    assert '4 apps, 1 failed' in summary.format()
+    assert monorepo.main([str(tmp_path / 'world'), '--workers', '1']) == 0
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import threading
+import tracemalloc
+
+from jinja2 import Template
+
+from lain_sdk import mydocker
+from lain_sdk.lain_yaml import TEMPLATE_DIR
+
+
+class Zeros(object):
+
+    def __init__(self, size):
+        self.left = size
+
+    def read(self, size=-1):
+        size = self.left if size < 0 else min(size, self.left)
+        self.left -= size
+        return bytes(size)
+
+
+def release_archive(files):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        tar.addfile(tarfile.TarInfo('release'), None)
+        for name, data in files.items():
+            info = tarfile.TarInfo(f'release/{name}')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        link = tarfile.TarInfo('release/lain/app/hi-link')
+        link.type, link.linkname = tarfile.LNKTYPE, 'release/lain/app/hi'
+        tar.addfile(link)
+    return buf.getvalue()
+
+
+def test_render_dockerfile():
+    source = open(f'{TEMPLATE_DIR}/build_dockerfile.j2').read()
+    params = {'base': 'golang', 'workdir': '/lain/app/', 'copy_list': ['.'], 'scripts': ['make'],
+              'build_args': ['A']}
+    assert mydocker.render_dockerfile(source, params) == Template(source).render(params)
+    # the compiled template is cached, not its output
+    assert mydocker.render_dockerfile(source, dict(params, base='ubuntu')) == \
+        Template(source).render(dict(params, base='ubuntu'))
+
+
+def test_relay_context():
+    archive = release_archive({'usr/bin/hello': b'hello', 'lain/app/hi': b'hi'})
+    out = io.BytesIO()
+    mydocker.relay_context(io.BytesIO(archive), out, 'FROM ubuntu\nCOPY . /\n', 'release')
+    out.seek(0)
+    with tarfile.open(fileobj=out) as tar:
+        assert tar.getnames() == ['Dockerfile', '.dockerignore', 'usr/bin/hello', 'lain/app/hi', 'lain/app/hi-link']
+        assert tar.extractfile('Dockerfile').read() == b'FROM ubuntu\nCOPY . /\n'
+        assert tar.extractfile('usr/bin/hello').read() == b'hello'
+        assert tar.getmember('lain/app/hi-link').linkname == 'lain/app/hi'
+
+
+def test_relay_context_memory_is_bounded():
+    size = 64 * 1024 * 1024
+    source_r, source_w = os.pipe()
+    out_r, out_w = os.pipe()
+
+    def produce():
+        with os.fdopen(source_w, 'wb') as f, tarfile.open(fileobj=f, mode='w|') as tar:
+            info = tarfile.TarInfo('release/assets.bin')
+            info.size = size
+            tar.addfile(info, Zeros(size))
+
+    received = []
+
+    def consume():
+        with os.fdopen(out_r, 'rb') as f:
+            received.append(sum(len(chunk) for chunk in iter(lambda: f.read(1 << 16), b'')))
+
+    threads = [threading.Thread(target=produce), threading.Thread(target=consume)]
+    for t in threads:
+        t.start()
+    tracemalloc.start()
+    with os.fdopen(source_r, 'rb') as archive, os.fdopen(out_w, 'wb') as out:
+        mydocker.relay_context(archive, out, 'FROM scratch\n', 'release')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for t in threads:
+        t.join()
+    assert received[0] > size
+    print(f'\nrelayed {size >> 20}MiB with a {peak >> 10}KiB peak')
+    assert peak < 4 * 1024 * 1024
+
+
+def test_stream_build(tmp_path, monkeypatch):
+    source = tmp_path / 'release.tar'
+    source.write_bytes(release_archive({'usr/bin/hello': b'hello'}))
+    listing = tmp_path / 'context.txt'
+    list_context = ('import sys, tarfile\n'
+                    'names = tarfile.open(fileobj=sys.stdin.buffer, mode="r|").getnames()\n'
+                    f'open({str(listing)!r}, "w").write(",".join(names))\n')
+    commands = []
+
+    def fake_popen(args, **kwargs):
+        commands.append(args)
+        cmd = ['cat', str(source)] if args[0] == 'cp' else [sys.executable, '-c', list_context]
+        return subprocess.Popen(cmd, **kwargs)
+
+    monkeypatch.setattr(mydocker, '_docker_popen', fake_popen)
+    name = mydocker.stream_build('hello:release', 'tmp-container', '/lain/release', 'FROM {{ base }}',
+                                 {'base': 'ubuntu'})
+    assert name == 'hello:release'
+    assert commands[0] == ['cp', 'tmp-container:/lain/release', '-']
+    assert commands[1] == ['build', '-t', 'hello:release', '-']
+    assert listing.read_text() == 'Dockerfile,.dockerignore,usr/bin/hello,lain/app/hi-link'
+
+
+def test_stream_context_build_leaves_repo_alone(tmp_path, monkeypatch):
+    from lain_sdk.lain_yaml import LainYaml
+
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    (repo / 'lain.yaml').write_text(open('tests/lain.yaml').read())
+    (repo / 'hello.go').write_text('package main')
+    contexts = []
+
+    def fake_popen(args, **kwargs):
+        contexts.append(args)
+        return subprocess.Popen([sys.executable, '-c', 'import sys; sys.stdin.buffer.read()'], **kwargs)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('docker build should read the context from stdin')
+
+    monkeypatch.setattr(mydocker, '_docker_popen', fake_popen)
+    monkeypatch.setattr(mydocker, 'build_image', fail)
+    y = LainYaml(lain_yaml_path=str(repo / 'lain.yaml'), ignore_prepare=True, stream_context=True)
+    assert y.build_meta() == (True, y.img_names['meta'])
+    assert contexts == [['build', '-t', y.img_names['meta'], '-']]
+    assert sorted(os.listdir(repo)) == ['hello.go', 'lain.yaml']
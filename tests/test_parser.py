@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 import copy
 import json
+import random
+import threading
+import warnings
 from unittest import TestCase
 
+import humanfriendly
 import pytest
 from marshmallow import ValidationError
 
 from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.yaml import conf
 from lain_sdk.yaml.conf import PRIVATE_REGISTRY
-from lain_sdk.yaml.parser import DOMAIN, LainYamlSchema, ProcType
+from lain_sdk.yaml.parser import (DOMAIN, LAIN_YAML_SCHEMA, LainYamlSchema, ProcType,
+                                  _parse_port_str, parse_memory, parse_port, parse_timespan)
 
 DOMAINS = ['extra.domain1.com', 'extra.domain2.org', DOMAIN]
 
@@ -87,6 +93,31 @@ def test_annotation():
     assert web.mountpoint == annotation['mountpoint']
 
 
+def test_annotation_is_lazy():
+    schema = LainYamlSchema(context={'meta_version': '123456-abcdefg', 'domains': DOMAINS,
+                                     'registry': PRIVATE_REGISTRY})
+    web = schema.load({'appname': 'hello', 'web': default_web})['procs']['web']
+    # not a key until it is read, and made from the proc as it is then
+    assert 'annotation' not in web
+    assert 'annotation' not in list(web)
+    web['cmd'] = ['changed']
+    annotation = web.get('annotation')
+    assert annotation is web['annotation']
+    assert 'annotation' in web.keys()
+    assert json.loads(annotation)['cmd'] == ['changed']
+    assert json.loads(annotation)['type'] == 'web'
+    assert json.loads(annotation)['port'] == {'80': {'type': 'tcp', 'port': 80}}
+    web['cmd'] = ['changed', 'again']
+    assert web['annotation'] is annotation
+
+
+def test_annotation_in_to_dict():
+    web = make_lain_yaml().procs['web']
+    assert 'annotation' not in web.to_dict()
+    annotation = web.annotation
+    assert web.to_dict()['annotation'] == annotation
+
+
 def test_volumes():
     volumes = ['/data', '/lain/logs', '/var/lib/mysql']
     volumes.sort()
@@ -680,3 +711,141 @@ def test_release(release_yaml):
     meta_version = '123456-abcdefg'
     app_conf = LainYaml(data=release_yaml, meta_version=meta_version)
     assert tuple(app_conf.release.copy) == ({'dest': '/usr/bin/hello', 'src': 'hello'}, {'dest': 'hi', 'src': 'hi'})
+
+
+def test_shared_schema_loads_like_a_fresh_one():
+    data = open('tests/lain.yaml').read()
+    context = {'meta_version': default_meta_version, 'domains': DOMAINS, 'registry': PRIVATE_REGISTRY}
+    assert LAIN_YAML_SCHEMA.load_with_context(data, context) == LainYamlSchema(context=context).load(data)
+
+
+def test_shared_schema_context_is_per_thread():
+    data = open('tests/lain.yaml').read()
+    errors = []
+
+    def load(meta_version):
+        context = {'meta_version': meta_version, 'domains': DOMAINS, 'registry': PRIVATE_REGISTRY}
+        for _ in range(20):
+            loaded = LAIN_YAML_SCHEMA.load_with_context(data, context)
+            if loaded['meta_version'] != meta_version:
+                errors.append(loaded['meta_version'])
+
+    threads = [threading.Thread(target=load, args=(f'{i}-abc', )) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert LAIN_YAML_SCHEMA.context == {}
+
+
+def test_defaults_not_shared_between_loads():
+    meta_version = '123456-abcdefg'
+    LainYaml(data='appname: a\nworker.w:\n  persistent_dirs: [/foo]\n', meta_version=meta_version)
+    app_conf = LainYaml(data='appname: b\nworker.w:\n  cmd: x\n', meta_version=meta_version)
+    assert tuple(app_conf.procs['w'].volumes) == ('/lain/logs', )
+
+
+def test_memoized_unit_parsing():
+    rng = random.Random(0)
+    corpus = [(rng.choice(['32m', '64m', '128m', '1g']), rng.choice(['10s', '30s', '1m']),
+               rng.choice(['80:tcp', '8080:tcp', '53:udp']))
+              for _ in range(10000)]
+
+    uncached = [(humanfriendly.parse_size(memory), humanfriendly.parse_timespan(timespan),
+                 _parse_port_str.__wrapped__(port)) for memory, timespan, port in corpus]
+    cached = [(parse_memory(memory), parse_timespan(timespan), _parse_port_str(port))
+              for memory, timespan, port in corpus]
+    assert cached == uncached
+
+
+def test_parsed_ports_are_not_shared():
+    first, second = parse_port('8080:tcp'), parse_port('8080:tcp')
+    assert first == second
+    first[8080]['port'] = 1
+    assert second[8080]['port'] == 8080
+    _parse_port_str.cache_clear()
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            parse_port('8080:sctp')
+    assert _parse_port_str.cache_info().currsize == 0
+
+
+def test_mountpoint_expansion_covers_every_domain():
+    domains = [f'app.domain{i}.com' for i in range(100)]
+    paths = [f'/path{i}' for i in range(100)]
+    completed = LainYamlSchema.complete_mountpoint(paths * 2, domains, main_entrance=True)
+    # one url per path and domain, the repeated paths are dropped
+    assert completed == [f'{domain}{path}' for path in paths for domain in domains] + domains
+
+
+def test_mountpoints_are_deduplicated():
+    mountpoint = ['/foo', 'a.com/foo', '/foo', 'b.com']
+    completed = LainYamlSchema.complete_mountpoint(mountpoint, ['a.com', 'b.com'], main_entrance=True)
+    assert completed == ['a.com/foo', 'b.com', 'b.com/foo', 'a.com']
+    assert mountpoint == ['/foo', 'a.com/foo', '/foo', 'b.com']
+
+
+def test_mountpoint_clash():
+    meta_version = '123456-abcdefg'
+    data = 'appname: a\nweb: {mountpoint: [/x]}\nweb.admin: {mountpoint: [a.lain/x]}\n'
+    message = 'mountpoint a.lain/x of proc admin is already used by proc web'
+    # manifests sharing a mountpoint always loaded
+    with pytest.warns(UserWarning, match=message):
+        app_conf = LainYaml(data=data, meta_version=meta_version, domains=DOMAINS)
+    assert 'a.lain/x' in app_conf.procs['admin'].mountpoint
+    with pytest.warns(UserWarning, match=message), LAIN_YAML_SCHEMA.using_context({'domains': DOMAINS}):
+        assert LainYaml.validate(data) == {}
+
+
+def test_proc_type_must_be_a_member():
+    # attributes of the enum class are not proc types
+    for type_ in ('upper', 'name'):
+        data = f'appname: a\nproc.foo: {{type: {type_}, cmd: x}}\n'
+        with pytest.raises(ValidationError):
+            LainYaml(data=data, meta_version=default_meta_version)
+        assert LainYaml.validate(data)['procs']['foo'] == {'value': {'type': [f'Invalid enum member {type_}']}}
+    assert ProcType.web.value == 2
+
+
+def test_validate():
+    assert LainYaml.validate(open('tests/lain.yaml').read()) == {}
+    # mountpoints of an invalid app can only be compared as declared
+    with pytest.warns(UserWarning, match='mountpoint /x of proc c is already used by proc b'):
+        errors = LainYaml.validate('appname: service\nweb.a: {}\nweb.b: {mountpoint: [/x]}\n'
+                                   'web.c: {mountpoint: [/x]}\nworker: {num_instances: many}\n')
+    assert errors['appname'] == ['Invalid input.']
+    assert errors['procs']['worker'] == {'value': {'num_instances': ['Not a valid integer.']}}
+    assert errors['procs']['a'] == [LainYamlSchema.MISSING_MOUNTPOINT.format(name='a')]
+    assert 'c' not in errors['procs']
+    assert LainYaml.validate('appname: [')['_schema'][0].startswith('invalid yaml')
+
+
+def test_validate_reads_no_config(monkeypatch):
+    monkeypatch.setitem(conf._LAZY, 'DOMAIN', lambda: pytest.fail('validate read the lain configs'))
+    data = 'appname: a\nweb: {mountpoint: [/x]}\nweb.admin: {mountpoint: [a.lain/x]}\n'
+    # without domains the declared mountpoints are compared
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert LainYaml.validate(data) == {}
+
+
+@pytest.mark.parametrize('data', [
+    'appname: a\nworker: {memory: zzz}\n',
+    'appname: a\nweb:\n',
+    'appname: a\nweb: 3\n',
+    'appname: a\nproc.foo: {type: upper, cmd: x}\n',
+    'appname: a\nworker: {setup_time: soon}\n',
+    'appname: a\nweb.admin: {}\n',
+])
+def test_validate_agrees_with_load(data):
+    errors = LainYaml.validate(data)
+    assert errors
+    with pytest.raises(ValidationError) as e:
+        LainYaml(data=data, meta_version=default_meta_version)
+    if '_schema' in e.value.messages:
+        # finalize stops at the first semantic error, validate reports all of them
+        proc_errors = [message for messages in errors['procs'].values() for message in messages]
+        assert e.value.messages['_schema'][0] in proc_errors
+    else:
+        assert e.value.messages == errors
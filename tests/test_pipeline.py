@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import pytest
+
+from lain_sdk import mydocker
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.pipeline import DEPENDENCIES, Pipeline, critical_path, resolve
+
+YAML = 'tests/lain.yaml'
+
+
+def sleeping_tasks(seconds, failing=()):
+    def task(phase):
+        def run(y, results):
+            time.sleep(seconds[phase])
+            return (phase not in failing, None if phase in failing else f'hello:{phase}')
+        return run
+    return {phase: task(phase) for phase in seconds}
+
+
+def test_resolve():
+    assert resolve(['release'], DEPENDENCIES) == ['prepare', 'build', 'release']
+    with pytest.raises(ValueError):
+        resolve(['deploy'], DEPENDENCIES)
+    with pytest.raises(ValueError):
+        resolve(['a'], {'a': ('b', ), 'b': ('a', )})
+
+
+def test_critical_path():
+    durations = {'prepare': 1, 'build': 2, 'release': 3, 'test': 1, 'meta': 5}
+    assert critical_path(durations, DEPENDENCIES) == (['prepare', 'build', 'release'], 6)
+    assert critical_path({}, DEPENDENCIES) == ([], 0)
+
+
+def test_independent_phases_run_concurrently():
+    y = LainYaml(lain_yaml_path=YAML, ignore_prepare=True)
+    seconds = {'prepare': 0.05, 'build': 0.05, 'release': 0.2, 'test': 0.2, 'meta': 0.2}
+    result = Pipeline(y, tasks=sleeping_tasks(seconds), max_workers=3).run()
+    assert result.ok
+    assert result.results['release'] == (True, 'hello:release')
+    assert result.critical_path[:2] == ['prepare', 'build']
+    assert result.wall_time < result.serial_time - 0.2
+    assert 'critical path' in result.summary()
+
+
+def test_failed_phase_skips_dependents():
+    y = LainYaml(lain_yaml_path=YAML, ignore_prepare=True)
+    seconds = dict.fromkeys(DEPENDENCIES, 0)
+    result = Pipeline(y, phases=['test', 'meta'], tasks=sleeping_tasks(seconds, failing=['build'])).run()
+    assert list(result.results) == ['prepare', 'build', 'test', 'meta']
+    assert result.results['test'] == (False, None)
+    assert result.results['meta'] == (True, 'hello:meta')
+    assert 'test' not in result.durations
+    assert not result.ok
+
+
+def test_default_tasks_use_results_and_mode():
+    y = LainYaml(lain_yaml_path=YAML, ignore_prepare=True)
+    calls = []
+
+    def phase(name, image):
+        def run(**kwargs):
+            calls.append((name, kwargs))
+            return (True, image)
+        return run
+
+    y.build_prepare = phase('prepare', 'hello:other-prepare')
+    y.build_base = phase('build', y.img_names['build'])
+    y.build_release = phase('release', y.img_names['release'])
+    y.build_test = phase('test', y.img_names['test'])
+    result = Pipeline(y, phases=['release', 'test'], mode='multistage').run()
+    assert result.ok
+    calls = dict(calls)
+    # the prepare phase did not build the image build starts from
+    assert calls['build'] == {'use_prepare': False}
+    assert calls['release'] == {'use_prepare': True, 'use_build': True, 'mode': 'multistage'}
+    assert calls['test'] == {'use_build': True}
+
+    with pytest.raises(ValueError):
+        Pipeline(y, mode='docker')
+    with pytest.raises(ValueError):
+        Pipeline(y, tasks=sleeping_tasks({}), mode='legacy')
+
+
+def test_concurrent_builds_of_one_context(tmp_path, monkeypatch):
+    (tmp_path / '.dockerignore').write_text('node_modules\n')
+    seen = []
+
+    def fake_call(cmd, cwd=None, **kwargs):
+        dockerfile = cmd[cmd.index('-f') + 1]
+        seen.append((open(dockerfile).read(), open(os.path.join(cwd, '.dockerignore')).read()))
+        time.sleep(0.05)
+        return 0
+
+    monkeypatch.setattr(mydocker.subprocess, 'call', fake_call)
+    threads = [threading.Thread(target=mydocker.build, args=(
+        f'hello:{i}', str(tmp_path), ['.git'], 'FROM {{ base }}', {'base': f'base{i}'}, []))
+        for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(dockerfile for dockerfile, _ in seen) == [f'FROM base{i}' for i in range(4)]
+    assert all('node_modules\n' in ignore and '.git\n' in ignore for _, ignore in seen)
+    assert sorted(os.listdir(tmp_path)) == ['.dockerignore']
+    assert (tmp_path / '.dockerignore').read_text() == 'node_modules\n'